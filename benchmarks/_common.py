@@ -0,0 +1,26 @@
+# _common.py
+# 基准脚本共用：峰值 RSS、子进程隔离执行、JSON 报告输出
+import json
+import multiprocessing as mp
+import resource
+
+
+def peak_rss_mb():
+    # Linux 下 ru_maxrss 单位为 KB；它是进程生命周期内的最高值，因此每个配置都在新进程中测量
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_isolated(fn, *args):
+    """在全新的 spawn 子进程中执行 fn(*args) 并返回结果，使 peak_rss_mb 只反映该配置。"""
+    with mp.get_context("spawn").Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def write_report(report, output="-"):
+    """报告写为 JSON：output 为 "-" 时输出到标准输出，否则写入文件。"""
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output == "-":
+        print(text)
+    else:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
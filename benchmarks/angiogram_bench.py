@@ -0,0 +1,149 @@
+# angiogram_bench.py
+"""
+冠脉造影狭窄检测性能基准（CPU，无需 Streamlit）。
+
+用法:
+    python -m benchmarks.angiogram_bench -o bench_angiogram.json
+
+测量内容：
+    - 冷启动：构建网络结构、加载 checkpoint 并预热的耗时
+    - 单帧热延迟：多种分辨率下 run_inference_on_image 的 p50 / p95 / p99
+    - 吞吐量：不同 batch_size × 线程数下的帧/秒
+    - 峰值 RSS（冷启动、每个分辨率、每个吞吐量配置各自在新的子进程中运行，峰值互不影响）
+结果输出为 JSON，便于在 checkpoint 或 torchvision 版本变化时做回归对比。
+"""
+import argparse
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import torch
+import torchvision
+from PIL import Image
+
+from benchmarks._common import peak_rss_mb, run_isolated, write_report
+from utils.faster_rcnn import get_faster_rcnn_model
+from utils.inference_single import detect, run_inference_on_image
+from utils.model_registry import clear_registry, get_detector
+
+
+def synthetic_frame(side, seed=0):
+    """生成模拟造影帧：灰度噪声背景 + 若干条暗色"血管"曲线。"""
+    rng = np.random.default_rng(seed)
+    frame = rng.normal(170, 20, size=(side, side)).clip(0, 255)
+    xs = np.arange(side)
+    for _ in range(6):
+        amp, freq, phase = rng.uniform(0.05, 0.2) * side, rng.uniform(1, 4), rng.uniform(0, 2 * np.pi)
+        offset, width = rng.uniform(0.2, 0.8) * side, max(2, side // 100)
+        ys = (offset + amp * np.sin(freq * 2 * np.pi * xs / side + phase)).astype(int)
+        for dy in range(-width, width + 1):
+            valid = (ys + dy >= 0) & (ys + dy < side)
+            frame[ys[valid] + dy, xs[valid]] = 60
+    return Image.fromarray(frame.astype(np.uint8)).convert("RGB")
+
+
+def percentiles(samples_ms):
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {"n": len(samples_ms), "mean_ms": round(float(np.mean(samples_ms)), 2),
+            "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)}
+
+
+def bench_cold_start(model_path, device):
+    clear_registry()
+    start = time.perf_counter()
+    get_faster_rcnn_model(num_classes=2, pretrained=False)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_detector(model_path, device)
+    load_s = time.perf_counter() - start
+    return {"build_architecture_s": round(build_s, 3), "build_load_warmup_s": round(load_s, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def bench_latency_one(model_path, side, iterations, warmup=2):
+    """子进程入口：单一分辨率的热延迟。"""
+    image = synthetic_frame(side)
+    for _ in range(warmup):
+        run_inference_on_image(image, model_path=model_path, use_cache=False)
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run_inference_on_image(image, model_path=model_path, use_cache=False)
+        samples.append((time.perf_counter() - start) * 1000)
+    return dict(percentiles(samples), peak_rss_mb=round(peak_rss_mb(), 1))
+
+
+def bench_latency(model_path, resolutions, iterations, warmup=2):
+    return {str(side): run_isolated(bench_latency_one, model_path, side, iterations, warmup)
+            for side in resolutions}
+
+
+def bench_throughput_one(model_path, side, batch_size, threads, frames):
+    """子进程入口：单一 (batch_size, 线程数) 配置的吞吐量。"""
+    images = [synthetic_frame(side, seed=i) for i in range(frames)]
+    # 预热一个批次
+    detect(images[:batch_size], model_path=model_path, batch_size=batch_size,
+           num_threads=threads, use_cache=False)
+    start = time.perf_counter()
+    detect(images, model_path=model_path, batch_size=batch_size,
+           num_threads=threads, use_cache=False)
+    elapsed = time.perf_counter() - start
+    return {"threads": threads, "batch_size": batch_size, "frames": frames,
+            "frames_per_s": round(frames / elapsed, 3),
+            "ms_per_frame": round(elapsed * 1000 / frames, 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def bench_throughput(model_path, side, batch_sizes, thread_counts, frames):
+    return [run_isolated(bench_throughput_one, model_path, side, batch_size, threads, frames)
+            for threads in thread_counts for batch_size in batch_sizes]
+
+
+def run(model_path="config/faster_rcnn.pth", resolutions=(512, 1024, 2048), iterations=20,
+        batch_sizes=(1, 4, 8), thread_counts=None, throughput_side=512, throughput_frames=32):
+    device = torch.device("cpu")
+    thread_counts = thread_counts or sorted({1, max(1, (os.cpu_count() or 1) // 2), os.cpu_count() or 1})
+    default_threads = torch.get_num_threads()
+    stat = os.stat(model_path)
+
+    report = {
+        "env": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torchvision": torchvision.__version__,
+            "cpu_count": os.cpu_count(),
+            "default_threads": default_threads,
+            "platform": platform.platform(),
+        },
+        "checkpoint": {"path": model_path, "size_bytes": stat.st_size, "mtime": stat.st_mtime},
+        "cold_start": run_isolated(bench_cold_start, model_path, device),
+        "latency": bench_latency(model_path, resolutions, iterations),
+        "throughput": bench_throughput(model_path, throughput_side, batch_sizes, thread_counts, throughput_frames),
+    }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冠脉造影狭窄检测性能基准")
+    parser.add_argument("-o", "--output", default="-", help="JSON 输出文件（默认标准输出）")
+    parser.add_argument("--model-path", default="config/faster_rcnn.pth")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--threads", type=int, nargs="+", default=None)
+    parser.add_argument("--throughput-side", type=int, default=512)
+    parser.add_argument("--throughput-frames", type=int, default=32)
+    args = parser.parse_args(argv)
+
+    report = run(model_path=args.model_path, resolutions=args.resolutions, iterations=args.iterations,
+                 batch_sizes=args.batch_sizes, thread_counts=args.threads,
+                 throughput_side=args.throughput_side, throughput_frames=args.throughput_frames)
+    write_report(report, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
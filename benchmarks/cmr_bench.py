@@ -0,0 +1,200 @@
+# cmr_bench.py
+"""
+CMR 分割性能与 Dice 回归基准（CPU，无需 Streamlit）。
+
+用法:
+    python -m benchmarks.cmr_bench -o bench_cmr.json
+    python -m benchmarks.cmr_bench --h5 data/patient001.h5 --backend tflite --quantization fp16
+
+测量内容（每个体数据 × 每个 batch_size）：
+    - 各阶段耗时：h5 读取 / 预处理 / 推理 / 后处理
+    - 每张切片耗时与峰值 RSS（每个配置在独立的子进程中运行，峰值互不影响）
+    - h5 中含 'label' 参考掩码时计算逐类别 Dice（后处理前后各一次）
+默认生成合成 h5 体数据（心脏环形模体，带 'label'），也可以用 --h5 指定真实数据。
+结果输出为 JSON，便于在后端、预处理或模型变化时同时对比速度和精度。
+"""
+import argparse
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+import h5py
+import numpy as np
+
+from benchmarks._common import peak_rss_mb, run_isolated, write_report
+from utils.cmr_postprocess import postprocess_masks
+from utils.cmr_preprocess import preprocess_stack
+from utils.cmr_quant import LV, MYO, RV
+from utils.cmr_tflite import dice_per_class
+
+
+def synthetic_volume(n_slices, side, seed=0):
+    """
+    生成模拟短轴 cine 切片及参考掩码：LV 血池（亮）+ MYO 环（暗）+ 一侧 RV 新月形（亮）。
+
+    Returns:
+        image: (N, side, side) float32，label: (N, side, side) uint8
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:side, :side]
+    image = np.empty((n_slices, side, side), dtype=np.float32)
+    label = np.zeros((n_slices, side, side), dtype=np.uint8)
+    for i in range(n_slices):
+        # 从基底到心尖 LV 半径逐渐减小
+        cy, cx = side / 2 + rng.normal(0, side * 0.01, size=2)
+        r_lv = side * (0.12 - 0.06 * i / max(1, n_slices - 1))
+        r_myo = r_lv + side * 0.04
+        dist = np.hypot(yy - cy, xx - cx)
+        rv_dist = np.hypot(yy - cy, xx - (cx - r_myo * 1.3))
+
+        lab = label[i]
+        lab[(rv_dist < r_myo * 1.1) & (dist >= r_myo)] = RV
+        lab[(dist >= r_lv) & (dist < r_myo)] = MYO
+        lab[dist < r_lv] = LV
+
+        intensity = np.array([40, 180, 80, 200], dtype=np.float32)[lab]
+        image[i] = intensity + rng.normal(0, 12, size=(side, side))
+    return image.clip(0, None), label
+
+
+def write_h5(path, image, label=None):
+    with h5py.File(path, "w") as f:
+        f.create_dataset("image", data=image)
+        if label is not None:
+            f.create_dataset("label", data=label)
+
+
+def load_reference(path, target_size=(256, 256)):
+    """读取 h5 中的 'label' 参考掩码并最近邻缩放到模型分辨率；没有时返回 None。"""
+    with h5py.File(path, "r") as f:
+        if "label" not in f:
+            return None
+        label = f["label"][()]
+    stack = label[np.newaxis] if label.ndim == 2 else label.reshape((-1,) + label.shape[-2:])
+    height, width = target_size
+    return np.stack([cv2.resize(s.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+                     for s in stack])
+
+
+def get_predictor(model_path, backend="keras", quantization=None):
+    """返回 predict(batch) -> (n, H, W) 掩码，模型已加载并预热。"""
+    if backend == "tflite":
+        from utils.cmr_tflite import get_tflite_segmenter
+        segmenter = get_tflite_segmenter(model_path, quantization)
+        return lambda batch: np.argmax(segmenter.predict(batch), axis=-1)
+
+    from utils.cmr_segment import get_segmentation_model, predict_masks
+    model = get_segmentation_model(model_path)
+    return lambda batch: predict_masks(model, batch)[1]
+
+
+def bench_volume(path, predict, batch_size):
+    timings = {}
+
+    start = time.perf_counter()
+    with h5py.File(path, "r") as f:
+        image = f["image"][()]
+    timings["load_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stack = image.reshape((-1,) + image.shape[-2:]) if image.ndim == 4 else image
+    volume = preprocess_stack(stack)
+    timings["preprocess_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    masks = np.empty(volume.shape[:3], dtype=np.uint8)
+    for i in range(0, len(volume), batch_size):
+        masks[i:i + batch_size] = predict(volume[i:i + batch_size])
+    timings["predict_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    post_masks = postprocess_masks(masks)
+    timings["postprocess_s"] = time.perf_counter() - start
+
+    n = len(volume)
+    total = sum(timings.values())
+    item = {k: round(v, 4) for k, v in timings.items()}
+    item.update(slices=n, batch_size=batch_size, total_s=round(total, 4),
+                ms_per_slice=round(total * 1000 / n, 2), peak_rss_mb=round(peak_rss_mb(), 1))
+
+    reference = load_reference(path)
+    if reference is not None:
+        item["dice"] = dice_per_class(reference, masks)
+        item["dice_postprocessed"] = dice_per_class(reference, post_masks)
+    return item
+
+
+def bench_cold_start(model_path, backend, quantization):
+    start = time.perf_counter()
+    get_predictor(model_path, backend, quantization)
+    return {"load_warmup_s": round(time.perf_counter() - start, 3), "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def bench_config(path, model_path, backend, quantization, batch_size):
+    """子进程入口：加载模型后测量一个 (体数据, batch_size) 配置。"""
+    predict = get_predictor(model_path, backend, quantization)
+    loaded_rss = peak_rss_mb()
+    with h5py.File(path, "r") as f:
+        shape = f["image"].shape
+    item = {"volume": os.path.basename(path), "shape": list(shape)}
+    item.update(bench_volume(path, predict, batch_size))
+    item["model_loaded_rss_mb"] = round(loaded_rss, 1)
+    item["inference_rss_delta_mb"] = round(item["peak_rss_mb"] - loaded_rss, 1)
+    return item
+
+
+def run(model_path="config/duck_net_model.h5", backend="keras", quantization=None, h5_paths=None,
+        slice_counts=(10, 40), sizes=(256, 512), batch_sizes=(1, 4, 8, 16)):
+    tmp_dir = None
+    if not h5_paths:
+        tmp_dir = tempfile.TemporaryDirectory()
+        h5_paths = []
+        for n in slice_counts:
+            for side in sizes:
+                path = os.path.join(tmp_dir.name, f"synthetic_{n}x{side}.h5")
+                write_h5(path, *synthetic_volume(n, side))
+                h5_paths.append(path)
+
+    try:
+        cold_start = run_isolated(bench_cold_start, model_path, backend, quantization)
+        results = [run_isolated(bench_config, path, model_path, backend, quantization, batch_size)
+                   for path in h5_paths for batch_size in batch_sizes]
+    finally:
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    return {
+        "env": {
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "platform": platform.platform(),
+        },
+        "model": {"path": model_path, "backend": backend, "quantization": quantization},
+        "cold_start": cold_start,
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CMR 分割性能与 Dice 回归基准")
+    parser.add_argument("-o", "--output", default="-", help="JSON 输出文件（默认标准输出）")
+    parser.add_argument("--model-path", default="config/duck_net_model.h5")
+    parser.add_argument("--backend", default="keras", choices=["keras", "tflite"])
+    parser.add_argument("--quantization", default=None, choices=["fp16", "dynamic", "int8"])
+    parser.add_argument("--h5", nargs="+", default=None, help="真实 h5 文件（默认生成合成体数据）")
+    parser.add_argument("--slices", type=int, nargs="+", default=[10, 40])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args(argv)
+
+    report = run(model_path=args.model_path, backend=args.backend, quantization=args.quantization,
+                 h5_paths=args.h5, slice_counts=args.slices, sizes=args.sizes, batch_sizes=args.batch_sizes)
+    write_report(report, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
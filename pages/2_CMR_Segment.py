@@ -1,15 +1,18 @@
 import streamlit as st
 import numpy as np
-import torch
-from PIL import Image
+import pandas as pd
 import cv2
 import os
-import io
-import h5py
-import tensorflow as tf
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
+import time
+import weakref
 import base64
+from utils.cmr_preprocess import h5_volume_shape, iter_h5_chunks, read_h5_slice, spool_to_disk
+from utils.cmr_export import export_cached
+from utils.cmr_postprocess import timed_postprocess
+from utils.cmr_render import render_thumbnail_grid_png, render_triptych_png
+from utils.cmr_quant import quantify_volumes, read_h5_geometry, slice_class_counts
+from utils.inference_server import ServerBusy, get_shared_server, server_enabled
+from utils.result_cache import array_digest
 
 def set_background(image_path):
     with open(image_path, "rb") as f:
@@ -131,10 +134,29 @@ st.markdown("---")
 
 if 'show_result' not in st.session_state:
     st.session_state['show_result'] = False
-if 'pred_mask' not in st.session_state:
-    st.session_state['pred_mask'] = None
-if 'image_np' not in st.session_state:
-    st.session_state['image_np'] = None
+if 'pred_masks' not in st.session_state:
+    st.session_state['pred_masks'] = None
+if 'masks_digest' not in st.session_state:
+    st.session_state['masks_digest'] = None
+if 'volume' not in st.session_state:
+    st.session_state['volume'] = None
+if 'slice_counts' not in st.session_state:
+    st.session_state['slice_counts'] = None
+if 'geometry' not in st.session_state:
+    st.session_state['geometry'] = None
+if 'timings' not in st.session_state:
+    st.session_state['timings'] = {}
+
+# --------------------
+# 分割模型后端：名称 -> (后端, TFLite 量化方式)
+# TFLite 首次使用时由 duck_net_model.h5 转换生成，之后直接加载
+# --------------------
+SEGMENTATION_BACKENDS = {
+    "UNet": ("keras", None),
+    "UNet（TFLite CPU 加速）": ("tflite", None),
+    "UNet（TFLite fp16）": ("tflite", "fp16"),
+    "UNet（TFLite int8 动态量化）": ("tflite", "dynamic"),
+}
 
 # --------------------
 # 上传图像 + 参数设置（横向布局）
@@ -147,130 +169,177 @@ with st.container():
         uploaded_file = st.file_uploader("请上传一张二维灰度 Cine MRI 图像（.h5 格式）", type=["h5"])
     with col2:
         st.markdown("### ⚙️ 分割参数设置")
-        model_choice = st.selectbox("选择分割模型", ["UNet"])
-        st.markdown("<div style='height: 90px;'></div>", unsafe_allow_html=True)
+        model_choice = st.selectbox("选择分割模型", list(SEGMENTATION_BACKENDS))
+        batch_size = st.slider("体数据模式批大小（每次推理的切片数）", 1, 32, 8)
+        postprocess = st.checkbox("后处理（去除孤岛 / LV 填洞 / 心肌环约束）", value=True)
 # --------------------
-# 模型加载（带缓存）: Keras 版本
+# 模型推理：启用推理服务（CHR_INFERENCE_SERVER=1）时提交到常驻模型的工作进程，
+# 否则在页面进程内推理（推理服务使用其自身配置的后端）
 # --------------------
-def load_model(model_path):
-    return tf.keras.models.load_model(model_path)
+def segment_image(image_np, model_path, backend=("keras", None)):
+    if server_enabled():
+        server = get_shared_server()
+        job_id = server.submit("segment", {"image": image_np.astype(np.float32)}, timeout=30)
+        return server.wait(job_id, timeout=600)
+
+    if backend[0] == "tflite":
+        from utils.cmr_tflite import run_inference
+        _, pred_mask = run_inference(image_np, model_path, quantization=backend[1])
+    else:
+        from utils.cmr_segment import run_inference
+        _, pred_mask = run_inference(image_np, model_path)
+    return pred_mask
 
-# --------------------
-# 读取单张 h5 图像（支持2D/3D）
-# --------------------
-def load_h5_data(file_obj, is_training=False, target_size=(256, 256), normalize=True):
-    images = []
 
-    if isinstance(file_obj, str):
-        f = h5py.File(file_obj, 'r')
-    else:
-        f = h5py.File(file_obj, 'r')  # Streamlit UploadedFile or BytesIO
-
-    with f:
-        image = f['image'][:]
-
-        if image.ndim == 3:
-            for idx in range(image.shape[0]):
-                slice_img = image[idx][..., np.newaxis]
-                slice_img = tf.image.resize(slice_img, target_size, method='bilinear').numpy()
-                if normalize:
-                    slice_img /= np.max(slice_img) + 1e-8
-                images.append(slice_img)
-            return images, None
-
-        elif image.ndim == 2:
-            image = image[..., np.newaxis]
-            image = tf.image.resize(image, target_size, method='bilinear').numpy()
-            if normalize:
-                image /= np.max(image) + 1e-8
-            return image, None
-        else:
-            raise ValueError(f"Unsupported image shape: {image.shape}")
+def segment_volume(h5_path, n_slices, model_path, batch_size, backend=("keras", None)):
+    """
+    体数据模式：从磁盘逐块读取切片并分批推理，整个 h5 数据集不会一次性读入内存。
 
-# --------------------
-# 模型推理
-# --------------------
-def run_inference(image_np, model_path):
-    if image_np.ndim != 3:
-        raise ValueError("Input image must be a single (H, W, 1) array.")
+    Returns:
+        display: (N, H, W, 1) uint8 预览图像堆栈
+        pred_masks: (N, H, W) uint8 掩码堆栈
+    """
+    display = np.empty((n_slices, 256, 256, 1), dtype=np.uint8)
+    pred_masks = np.empty((n_slices, 256, 256), dtype=np.uint8)
+
+    def chunks():
+        for index, chunk in iter_h5_chunks(h5_path, chunk_size=batch_size * 4):
+            display[index:index + len(chunk)] = chunk * 255
+            yield index, chunk
+
+    if server_enabled():
+        # 逐切片提交，工作进程会把同时排队的切片合并成批次
+        server = get_shared_server()
+        for index, chunk in chunks():
+            job_ids = [server.submit("segment", {"image": s}, timeout=30) for s in chunk]
+            pred_masks[index:index + len(chunk)] = [server.wait(job_id, timeout=600) for job_id in job_ids]
+        return display, pred_masks
+
+    if backend[0] == "tflite":
+        from utils.cmr_tflite import run_inference_stream
+        stream = run_inference_stream(chunks(), model_path, batch_size=batch_size, quantization=backend[1])
+    else:
+        from utils.cmr_segment import run_inference_stream
+        stream = run_inference_stream(chunks(), model_path, batch_size=batch_size)
+    for index, masks in stream:
+        pred_masks[index:index + len(masks)] = masks
+    return display, pred_masks
 
-    input_tensor = np.expand_dims(image_np, axis=0)
-    model = load_model(model_path)
 
-    pred_logits = model.predict(input_tensor)
-    pred_softmax = tf.nn.softmax(pred_logits, axis=-1).numpy()[0]
-    pred_mask = np.argmax(pred_softmax, axis=-1)
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
-    return pred_softmax, pred_mask
 
-# --------------------
-# 可视化三图合一：原图、掩码、叠加图
-# --------------------
-def visualize_three(image_np, mask, save_path=None, use_streamlit=True):
+class SpooledUpload:
     """
-    显示并可选择保存三联图（原图/掩码/叠加）
-    参数:
-        image_np: (H, W, 1) numpy array
-        mask:     (H, W)   numpy array
-        save_path: 若指定，将保存为 PNG
-        use_streamlit: 若为 True，使用 st.pyplot 显示
+    会话持有的上传临时文件。对象被回收（会话结束、被替换或移除）或进程退出时，
+    weakref.finalize 自动删除磁盘上的文件。
     """
-    fig, axs = plt.subplots(1, 3, figsize=(12, 4))
 
-    axs[0].imshow(image_np[:, :, 0], cmap="gray")
-    axs[0].set_title("Original")
-    axs[0].axis("off")
+    def __init__(self, file_id, path):
+        self.file_id = file_id
+        self.path = path
+        self._finalizer = weakref.finalize(self, _remove_file, path)
 
-    axs[1].imshow(mask, cmap="jet", vmin=0, vmax=np.max(mask))
-    axs[1].set_title("Predicted Mask")
-    axs[1].axis("off")
+    def release(self):
+        self._finalizer()
 
-    axs[2].imshow(image_np[:, :, 0], cmap="gray")
-    axs[2].imshow(mask, cmap="jet", alpha=0.5, vmin=0, vmax=np.max(mask))
-    axs[2].set_title("Overlay")
-    axs[2].axis("off")
 
-    if save_path:
-        plt.savefig(save_path, bbox_inches='tight')
+def spooled_upload_path(uploaded_file):
+    """上传文件只落盘一次（按 file_id 缓存在会话中），之后的重跑直接复用磁盘上的临时文件。"""
+    cached = st.session_state.get('h5_spool')
+    if cached and cached.file_id == uploaded_file.file_id and os.path.exists(cached.path):
+        return cached.path
+    release_spooled_upload()
+    spooled = SpooledUpload(uploaded_file.file_id, spool_to_disk(uploaded_file))
+    st.session_state['h5_spool'] = spooled
+    return spooled.path
 
-    if use_streamlit:
-        import streamlit as st
-        st.pyplot(fig)
-    else:
-        plt.show()
+
+def release_spooled_upload():
+    """删除会话中已落盘的上传文件（用户移除上传或换了文件时调用）。"""
+    cached = st.session_state.pop('h5_spool', None)
+    if cached is not None:
+        cached.release()
 
 # --------------------
-# 伪彩色掩码保存函数
+# 分割结果导出：格式 -> (文件名, MIME)
 # --------------------
-def save_mask_as_colormap(mask):
-    color_mask = (plt.cm.jet(mask / max(1, mask.max()))[:, :, :3] * 255).astype(np.uint8)
-    out_buf = io.BytesIO()
-    Image.fromarray(color_mask).save(out_buf, format="PNG")
-    out_buf.seek(0)
-    return out_buf
+EXPORT_FORMATS = {
+    "伪彩色 PNG（当前切片）": ("分割结果.png", "image/png"),
+    "逐切片 PNG 压缩包（.zip）": ("分割结果_png.zip", "application/zip"),
+    "原始标签 NPZ（.npz）": ("分割结果.npz", "application/octet-stream"),
+    "NIfTI（.nii.gz）": ("分割结果.nii.gz", "application/gzip"),
+    "HDF5（.h5）": ("分割结果.h5", "application/x-hdf5"),
+}
+
+
+def export_masks(fmt, pred_masks, result_idx, geometry, digest=None):
+    """只生成所选格式的下载数据（按掩码摘要缓存，重跑页面时不重复编码）。"""
+    spacing = (1.0, 1.0, 1.0)
+    if geometry is not None and geometry["pixel_spacing"] is not None:
+        row_mm, col_mm = geometry["pixel_spacing"]
+        height, width = geometry["shape"][-2:]
+        spacing = (col_mm * width / pred_masks.shape[2], row_mm * height / pred_masks.shape[1],
+                   geometry["slice_thickness"] or 1.0)
+
+    if fmt.startswith("伪彩色 PNG"):
+        return export_cached("png", pred_masks[result_idx])
+    if fmt.startswith("逐切片 PNG"):
+        return export_cached("png_zip", pred_masks, digest=digest)
+    if fmt.startswith("原始标签 NPZ"):
+        return export_cached("npz", pred_masks, spacing, digest=digest)
+    if fmt.startswith("NIfTI"):
+        return export_cached("nifti", pred_masks, spacing, digest=digest)
+    return export_cached("h5", pred_masks, spacing, digest=digest)
 # --------------------
 # 图像预览与模型推理
 # --------------------
-if uploaded_file:
+if not uploaded_file:
+    release_spooled_upload()
+else:
     try:
-        image_np, _ = load_h5_data(uploaded_file)
+        h5_path = spooled_upload_path(uploaded_file)
+        n_slices = int(np.prod(h5_volume_shape(h5_path)[:-2]))
         center_col = st.columns([1, 2, 1])[1]
         with center_col:
+            slice_idx = st.slider("预览切片", 0, n_slices - 1, 0) if n_slices > 1 else 0
+            image_np = read_h5_slice(h5_path, slice_idx)
             st.image(image_np[:, :, 0], caption="🖼️ 上传图像预览", width=300, clamp=True)
+            segment_all = n_slices > 1 and st.checkbox(f"分割全部 {n_slices} 张切片（体数据模式）", value=True)
 
         if st.button("🧠 执行自动分割", use_container_width=True):
             with st.spinner("模型正在处理图像，请稍候..."):
-                image_np = image_np / np.max(image_np)
+                start = time.perf_counter()
                 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
                 model_path = os.path.join(BASE_DIR, "..", "config", "duck_net_model.h5")
 
-                _, pred_mask = run_inference(image_np, model_path)
+                if segment_all:
+                    volume, pred_masks = segment_volume(h5_path, n_slices, model_path, batch_size,
+                                                        SEGMENTATION_BACKENDS[model_choice])
+                else:
+                    image_np = image_np / np.max(image_np)
+                    pred_masks = segment_image(image_np, model_path, SEGMENTATION_BACKENDS[model_choice])[np.newaxis].astype(np.uint8)
+                    volume = (image_np * 255).astype(np.uint8)[np.newaxis]
+                timings = {"分割": time.perf_counter() - start}
+                if postprocess:
+                    pred_masks, timings["后处理"] = timed_postprocess(pred_masks)
+                counts = slice_class_counts(pred_masks)
+                st.session_state['geometry'] = read_h5_geometry(h5_path)
 
                 # 状态缓存
                 st.session_state['show_result'] = True
-                st.session_state['pred_mask'] = pred_mask
-                st.session_state['image_np'] = image_np
-
+                st.session_state['pred_masks'] = pred_masks
+                st.session_state['masks_digest'] = array_digest(pred_masks)
+                st.session_state['volume'] = volume
+                st.session_state['slice_counts'] = counts
+                st.session_state['timings'] = timings
+
+    except ServerBusy:
+        st.warning("⏳ 当前分割任务较多，请稍后重试。")
     except Exception as e:
         st.error(f"❌ 图像处理失败：{e}")
 
@@ -278,10 +347,15 @@ if uploaded_file:
 # 结果展示 + 下载按钮
 # --------------------
 if st.session_state['show_result']:
-    pred_mask = st.session_state['pred_mask']
-    image_np = st.session_state['image_np']
+    pred_masks = st.session_state['pred_masks']
+    volume = st.session_state['volume']
+    counts = st.session_state['slice_counts']
 
     st.markdown("### 🧾 分割结果展示")
+    st.caption("耗时：" + "，".join(f"{name} {seconds:.2f} s" for name, seconds in st.session_state['timings'].items()))
+    result_idx = st.slider("查看切片", 0, len(pred_masks) - 1, 0) if len(pred_masks) > 1 else 0
+    pred_mask = pred_masks[result_idx]
+    image_np = volume[result_idx]
     st.markdown("**颜色 ↔ 解剖结构对照表（Jet伪彩色映射）：**", unsafe_allow_html=True)
 
     color_legend_html = """
@@ -305,25 +379,76 @@ if st.session_state['show_result']:
     """
     st.markdown(color_legend_html, unsafe_allow_html=True)
 
-    visualize_three(image_np, pred_mask)
+    # 原图 / 掩码 / 叠加三联图：NumPy 直接合成，PNG 按内容哈希缓存
+    st.image(render_triptych_png(image_np, pred_mask), caption="Original / Predicted Mask / Overlay",
+             use_container_width=True)
+    if len(pred_masks) > 1:
+        with st.expander(f"🗂️ 全部 {len(pred_masks)} 张切片缩略图", expanded=False):
+            st.image(render_thumbnail_grid_png(volume, pred_masks), use_container_width=True)
+
+    st.markdown("### 📊 各切片像素统计")
+    st.dataframe(pd.DataFrame({
+        "切片": np.arange(len(counts)),
+        "左心室 LV (像素)": counts[:, 3],
+        "心肌层 MYO (像素)": counts[:, 2],
+        "右心室 RV (像素)": counts[:, 1],
+    }), hide_index=True)
+
+    # --------------------
+    # 心功能定量：容积 / 射血分数 / 心肌质量
+    # --------------------
+    geometry = st.session_state['geometry']
+    if len(pred_masks) > 1 and geometry is not None:
+        st.markdown("### 🫀 心功能定量")
+        shape = geometry["shape"]
+        spacing = geometry["pixel_spacing"] or (1.0, 1.0)
+        if geometry["pixel_spacing"] is None or geometry["slice_thickness"] is None:
+            st.info("文件中未找到像素间距或层厚信息，请手动填写。")
+
+        q1, q2, q3 = st.columns(3)
+        with q1:
+            n_phases = st.number_input("时相数", 1, len(pred_masks), shape[0] if len(shape) == 4 else 1)
+        with q2:
+            pixel_mm = st.number_input("像素间距 (mm)", 0.1, 5.0, float(spacing[0]), 0.05)
+        with q3:
+            thickness_mm = st.number_input("层厚 (mm)", 0.5, 20.0, float(geometry["slice_thickness"] or 8.0), 0.5)
+
+        if len(pred_masks) % n_phases:
+            st.warning(f"切片总数 {len(pred_masks)} 不能被时相数 {n_phases} 整除。")
+        else:
+            quant = quantify_volumes(pred_masks, n_phases, (pixel_mm, pixel_mm * spacing[1] / spacing[0]),
+                                     thickness_mm, original_size=shape[-2:])
+            if n_phases > 1:
+                m1, m2, m3, m4, m5 = st.columns(5)
+                m1.metric("LV EDV", f"{quant['LV_EDV']:.1f} ml")
+                m2.metric("LV ESV", f"{quant['LV_ESV']:.1f} ml")
+                m3.metric("LV EF", f"{quant['LV_EF']:.1f} %")
+                m4.metric("RV EF", f"{quant['RV_EF']:.1f} %")
+                m5.metric("心肌质量", f"{quant['MYO_mass_g']:.1f} g")
+            else:
+                # 单时相无法区分舒张末期 / 收缩末期，只显示容积和心肌质量
+                m1, m2, m3 = st.columns(3)
+                m1.metric("LV 容积", f"{quant['LV_EDV']:.1f} ml")
+                m2.metric("RV 容积", f"{quant['RV_EDV']:.1f} ml")
+                m3.metric("心肌质量", f"{quant['MYO_mass_g']:.1f} g")
+                st.info("射血分数需要多个时相的数据，请设置正确的时相数。")
+            if n_phases > 1:
+                st.caption(f"舒张末期（ED）：第 {quant['ed_phase']} 时相；收缩末期（ES）：第 {quant['es_phase']} 时相")
+                st.line_chart(pd.DataFrame(quant["volumes_ml"]), x_label="时相", y_label="容积 (ml)")
 
     st.markdown("### 📥 下载分割结果")
 
-    normed_mask = pred_mask.astype(np.float32)
-    normed_mask /= (np.max(normed_mask) + 1e-8)
-    color_mask = (cm.jet(normed_mask)[:, :, :3] * 255).astype(np.uint8)
-
-    out_buf = io.BytesIO()
-    Image.fromarray(color_mask).save(out_buf, format="PNG")
-    out_buf.seek(0)
-
     dl_col = st.columns([1, 2, 1])[1]
     with dl_col:
+        formats = list(EXPORT_FORMATS) if len(pred_masks) > 1 else [list(EXPORT_FORMATS)[0]] + list(EXPORT_FORMATS)[2:]
+        export_format = st.selectbox("导出格式", formats)
+        file_name, mime = EXPORT_FORMATS[export_format]
         st.download_button(
-            label="⬇️ 下载伪彩色掩码",
-            data=out_buf.getvalue(),
-            file_name="分割结果.png",
-            mime="image/png",
+            label="⬇️ 下载伪彩色掩码" if export_format.startswith("伪彩色") else "⬇️ 下载分割结果",
+            data=export_masks(export_format, pred_masks, result_idx, st.session_state['geometry'],
+                              st.session_state['masks_digest']),
+            file_name=file_name,
+            mime=mime,
             use_container_width=True
         )
 
@@ -1,14 +1,16 @@
 import streamlit as st
 from PIL import Image
-import torch
-import torchvision.transforms as T
+import numpy as np
 import pandas as pd
 import base64
+import io
 import os
+import zipfile
 import sys
 from pathlib import Path
-# 导入utils模块
-from utils.inference_single import run_inference_on_image
+# 导入utils模块（PyTorch 只在页面进程内推理时才导入）
+from utils.detection import render_detections
+from utils.inference_server import ServerBusy, get_shared_server, server_enabled
 import streamlit.components.v1 as components
 
 # 获取当前文件所在目录（pages目录）
@@ -17,6 +19,8 @@ current_dir = Path(__file__).parent
 root_dir = current_dir.parent
 # 将根目录添加到Python路径
 model_path = os.path.join(root_dir, "config", "faster_rcnn.pth")
+# 检测器内部会把输入缩放到最长边不超过 1333，超大 BMP 先在此缩小，避免全分辨率张量带来的内存峰值
+MAX_SIDE = 1333
 
 
 def get_image_base64(image_path):
@@ -29,6 +33,46 @@ def get_base64_background(image_path):
         data = f.read()
     return base64.b64encode(data).decode()
 
+def load_uploaded_frames(uploaded_files):
+    """
+    读取上传的 bmp 文件或 zip 压缩包（整次造影），返回 ([(文件名, RGB 图像), ...], [(文件名, 错误), ...])。
+    zip 中的帧按文件名排序；无法读取的文件或压缩包成员跳过并记录错误，不影响其余帧。
+    """
+    frames, errors = [], []
+    for uploaded in uploaded_files:
+        try:
+            if uploaded.name.lower().endswith(".zip"):
+                with zipfile.ZipFile(uploaded) as zf:
+                    names = sorted(n for n in zf.namelist()
+                                   if n.lower().endswith(".bmp") and not n.startswith("__MACOSX/"))
+                    for name in names:
+                        try:
+                            image = Image.open(io.BytesIO(zf.read(name))).convert("RGB")
+                        except Exception as e:
+                            errors.append((f"{uploaded.name}/{name}", str(e)))
+                        else:
+                            frames.append((os.path.basename(name), image))
+            else:
+                frames.append((uploaded.name, Image.open(uploaded).convert("RGB")))
+        except Exception as e:
+            errors.append((uploaded.name, str(e)))
+    return frames, errors
+
+def detect_frames(images):
+    """
+    检测多帧图像，返回与输入顺序一致的 Detection 列表。
+    启用推理服务（CHR_INFERENCE_SERVER=1）时提交到常驻模型的工作进程并轮询结果，
+    否则在页面进程内推理。
+    """
+    if server_enabled():
+        server = get_shared_server()
+        job_ids = [server.submit("detect", {"image": np.asarray(image), "max_side": MAX_SIDE}, timeout=30)
+                   for image in images]
+        return [server.wait(job_id, timeout=600) for job_id in job_ids]
+
+    from utils.inference_single import detect
+    return detect(images, model_path=model_path, max_side=MAX_SIDE)
+
 bg_image = get_base64_background("data/images/bk.png")
 
 # 页面配置
@@ -700,10 +744,20 @@ with colright:
     """, unsafe_allow_html=True)
 
     # 页面主体布局
-    uploaded_file = st.file_uploader("📤 上传您的冠脉造影图像(bmp格式）", type=["bmp"])
+    uploaded_files = st.file_uploader(
+        "📤 上传您的冠脉造影图像(bmp格式，可多选，或上传整次造影的zip压缩包）",
+        type=["bmp", "zip"],
+        accept_multiple_files=True,
+    )
+    # 检测结果按图像内容缓存，调整阈值只重新过滤和绘图，不会重新推理
+    score_threshold = st.slider("置信度阈值", 0.5, 0.95, 0.7, 0.05)
 
-    if uploaded_file is not None:
-        image = Image.open(uploaded_file).convert("RGB")
+    frames, errors = load_uploaded_frames(uploaded_files) if uploaded_files else ([], [])
+    for name, error in errors:
+        st.warning(f"无法读取 {name}，已跳过：{error}")
+
+    if len(frames) == 1:
+        name, image = frames[0]
 
         st.markdown("##### ✅ 图像上传成功")
         
@@ -712,7 +766,11 @@ with colright:
 
         with st.spinner("🧠 正在识别狭窄区域，请稍候..."):
             try:
-                result_img, total, kept, scores = run_inference_on_image(image, model_path=model_path)
+                detection = detect_frames([image])[0]
+                result_img = render_detections(image, detection, score_threshold)
+                total = len(detection.scores)
+                scores = detection.filter(score_threshold).scores.tolist()
+                kept = len(scores)
 
                 # Step 2: 显示标注图像（替代原图）
                 st.success("识别完成 ✅")
@@ -721,7 +779,7 @@ with colright:
                 # Step 3: 检测统计
                 st.markdown("##### 📊 检测简报")
                 st.markdown(f"- **模型初步识别的狭窄区域总数**：{total}")
-                st.markdown(f"- **过滤后保留（置信度 > 0.7）的狭窄区域**：{kept}")
+                st.markdown(f"- **过滤后保留（置信度 > {score_threshold:.2f}）的狭窄区域**：{kept}")
                 if scores:
                     # 构建 DataFrame
                     df_scores = pd.DataFrame({
@@ -730,11 +788,49 @@ with colright:
                 })  
                     st.dataframe(df_scores, hide_index=True)
                 else:
-                    st.warning("未发现置信度大于 0.7 的狭窄区域。")
+                    st.warning(f"未发现置信度大于 {score_threshold:.2f} 的狭窄区域。")
 
+            except ServerBusy:
+                st.warning("当前分析任务较多，请稍后重试。")
             except Exception as e:
                 st.error(f"检测失败：{e}")
 
+    elif frames:
+        st.markdown(f"##### ✅ 已上传 {len(frames)} 帧图像")
+
+        with st.spinner(f"🧠 正在批量识别 {len(frames)} 帧图像中的狭窄区域，请稍候..."):
+            try:
+                detections = detect_frames([image for _, image in frames])
+                kept_scores = [d.filter(score_threshold).scores for d in detections]
+
+                st.success("识别完成 ✅")
+
+                # 批量检测简报：每帧一行
+                st.markdown("##### 📊 检测简报")
+                df_summary = pd.DataFrame({
+                    "文件名": [name for name, _ in frames],
+                    "识别总数": [len(d.scores) for d in detections],
+                    f"保留数（置信度 > {score_threshold:.2f}）": [len(k) for k in kept_scores],
+                    "最高置信度": [round(float(k.max()), 2) if len(k) else None for k in kept_scores],
+                })
+                st.dataframe(df_summary, hide_index=True)
+
+                with st.expander("🖼️ 查看各帧检测结果图", expanded=False):
+                    cols = st.columns(3)
+                    for i, ((name, image), detection) in enumerate(zip(frames, detections)):
+                        with cols[i % 3]:
+                            st.image(render_detections(image, detection, score_threshold),
+                                     caption=name, use_container_width=True)
+
+            except ServerBusy:
+                st.warning("当前分析任务较多，请稍后重试。")
+            except Exception as e:
+                st.error(f"检测失败：{e}")
+
+    elif uploaded_files and not errors:
+        st.warning("未在上传内容中找到 bmp 图像。")
+
+    if uploaded_files:
         # 拓展讲解区域
         with st.expander("📚 如何理解识别出的区域？"):
             st.markdown("""
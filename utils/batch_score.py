@@ -0,0 +1,157 @@
+# batch_score.py
+"""
+冠脉造影批量狭窄检测（命令行，无需 Streamlit）。
+
+用法:
+    python -m utils.batch_score <图像目录> -o results.jsonl [--batch-size 8] [--workers 4]
+
+递归扫描目录下的 .bmp 文件，线程池并行解码，复用进程级共享模型按批次检测，
+逐文件把结果流式写入 JSONL 或 CSV（由 --format 或输出文件扩展名决定）。
+
+推理耗时按组统计（每组为一起解码、一次送入 detect 的至多 4 × --batch-size 张图像）：
+    batch_infer_ms      该组检测的总耗时
+    batch_images        该组成功解码的图像数
+    infer_ms_batch_avg  batch_infer_ms / batch_images，组内平均值，并非单张图像的实测耗时
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from .cpu_backend import BACKENDS
+from .inference_single import detect
+
+FIELDS = ["file", "width", "height", "total_count", "kept_count",
+          "kept_boxes", "kept_scores", "decode_ms", "infer_ms_batch_avg", "batch_infer_ms",
+          "batch_images", "error"]
+
+
+def find_images(root, extensions=(".bmp",)):
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.lower().endswith(extensions):
+                paths.append(os.path.join(dirpath, name))
+    return sorted(paths)
+
+
+def _decode(path):
+    start = time.perf_counter()
+    try:
+        image = Image.open(path).convert("RGB")
+        return path, image, (time.perf_counter() - start) * 1000, None
+    except Exception as e:
+        return path, None, (time.perf_counter() - start) * 1000, str(e)
+
+
+class _Writer:
+    def __init__(self, path, fmt):
+        self.fmt = fmt
+        self.file = sys.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+        if fmt == "csv":
+            self.csv = csv.DictWriter(self.file, fieldnames=FIELDS)
+            self.csv.writeheader()
+
+    def write(self, row):
+        if self.fmt == "csv":
+            row = dict(row, kept_boxes=json.dumps(row["kept_boxes"]), kept_scores=json.dumps(row["kept_scores"]))
+            self.csv.writerow(row)
+        else:
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def score_directory(root, output="-", fmt="jsonl", model_path="config/faster_rcnn.pth",
+                    score_threshold=0.7, batch_size=8, workers=4, backend="eager",
+                    num_threads=None, max_side=None):
+    """
+    批量检测目录中的全部造影帧，结果逐行写出。解码下一组图像与当前组的检测并行进行。
+
+    Returns:
+        dict: 汇总信息（文件数、失败数、总耗时）
+    """
+    paths = find_images(root)
+    chunk_size = batch_size * 4
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+
+    writer = _Writer(output, fmt)
+    failed = 0
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = pool.map(_decode, chunks[0]) if chunks else None
+            for i in range(len(chunks)):
+                decoded = list(pending)
+                # 预取下一组：解码与当前组推理重叠
+                pending = pool.map(_decode, chunks[i + 1]) if i + 1 < len(chunks) else None
+
+                ok = [item for item in decoded if item[1] is not None]
+                infer_start = time.perf_counter()
+                detections = detect([image for _, image, _, _ in ok], model_path=model_path,
+                                    batch_size=batch_size, backend=backend, num_threads=num_threads,
+                                    max_side=max_side, use_cache=False) if ok else []
+                batch_infer_ms = (time.perf_counter() - infer_start) * 1000
+                results = dict(zip((path for path, _, _, _ in ok), detections))
+
+                for path, image, decode_ms, error in decoded:
+                    row = {field: None for field in FIELDS}
+                    row.update(file=os.path.relpath(path, root), decode_ms=round(decode_ms, 2), error=error)
+                    if error is None:
+                        detection = results[path]
+                        kept = detection.filter(score_threshold)
+                        row.update(
+                            width=image.width,
+                            height=image.height,
+                            total_count=len(detection.scores),
+                            kept_count=len(kept.scores),
+                            kept_boxes=[[round(v, 1) for v in box] for box in kept.boxes.tolist()],
+                            kept_scores=[round(v, 4) for v in kept.scores.tolist()],
+                            infer_ms_batch_avg=round(batch_infer_ms / len(ok), 2),
+                            batch_infer_ms=round(batch_infer_ms, 2),
+                            batch_images=len(ok),
+                        )
+                    else:
+                        failed += 1
+                        row.update(kept_boxes=[], kept_scores=[])
+                    writer.write(row)
+    finally:
+        writer.close()
+
+    return {"files": len(paths), "failed": failed, "seconds": round(time.perf_counter() - start, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冠脉造影批量狭窄检测")
+    parser.add_argument("root", help="包含 .bmp 造影帧的目录（递归扫描）")
+    parser.add_argument("-o", "--output", default="-", help="输出文件（默认标准输出）")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None,
+                        help="输出格式（默认按输出文件扩展名判断，否则 jsonl）")
+    parser.add_argument("--model-path", default="config/faster_rcnn.pth")
+    parser.add_argument("--score-threshold", type=float, default=0.7)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4, help="解码线程数")
+    parser.add_argument("--backend", choices=BACKENDS, default="eager")
+    parser.add_argument("--num-threads", type=int, default=None, help="PyTorch CPU 线程数")
+    parser.add_argument("--max-side", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    summary = score_directory(args.root, output=args.output, fmt=fmt, model_path=args.model_path,
+                              score_threshold=args.score_threshold, batch_size=args.batch_size,
+                              workers=args.workers, backend=args.backend,
+                              num_threads=args.num_threads, max_side=args.max_side)
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,487 @@
+# clinical.py
+"""
+冠心病 10 年风险预测：输入校验 + 批量队列评分（无需 Streamlit）。
+
+用法:
+    python -m utils.clinical cohort.csv -o scored.csv [--chunk-size 10000] [--fast]
+    python -m utils.clinical --check-fast [cohort.csv]
+
+CSV / Parquet 分块读取，每块一次性完成列校验与类型转换，
+按块调用 best_model_pipeline.pkl 的 predict_proba，结果逐块追加写出，内存占用与总行数无关。
+"""
+import argparse
+import io
+import json
+import sys
+import time
+import weakref
+from typing import NamedTuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from .result_cache import LRUCache
+
+# 模型训练时的特征列（顺序与页面输入一致）
+FEATURE_COLUMNS = [
+    "age", "education", "sex", "is_smoking", "cigsPerDay", "BPMeds", "prevalentStroke",
+    "prevalentHyp", "diabetes", "totChol", "sysBP", "diaBP", "BMI", "heartRate", "glucose",
+]
+
+# 类别特征：训练数据中的取值，以及常见写法 -> 训练取值
+CATEGORICAL_VALUES = {
+    "sex": {"M": "M", "MALE": "M", "男": "M", "F": "F", "FEMALE": "F", "女": "F"},
+    "is_smoking": {"YES": "YES", "Y": "YES", "1": "YES", "TRUE": "YES", "是": "YES",
+                   "NO": "NO", "N": "NO", "0": "NO", "FALSE": "NO", "否": "NO"},
+}
+NUMERIC_COLUMNS = [c for c in FEATURE_COLUMNS if c not in CATEGORICAL_VALUES]
+
+RISK_COLUMN = "risk_probability"
+LABEL_COLUMN = "high_risk"
+
+# 默认高风险判定阈值（与 LogisticRegression.predict 一致）
+DEFAULT_THRESHOLD = 0.5
+
+
+def load_model(model_path="config/best_model_pipeline.pkl"):
+    return joblib.load(model_path)
+
+
+# --------------------
+# 输入校验与类型转换
+# --------------------
+def coerce_features(frame):
+    """
+    向量化校验并转换特征列，返回 (特征 DataFrame, 每列无效值个数)。
+
+    - 缺少特征列时抛出 ValueError；多余的列忽略
+    - 数值列统一转为 float64，无法解析的值置为 NaN（由模型内的中位数填充处理）
+    - 类别列去空格、转大写后映射到训练取值，无法识别的值置为 NaN（由众数填充处理）
+    """
+    missing = [c for c in FEATURE_COLUMNS if c not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing feature columns: {missing}")
+
+    features = pd.DataFrame(index=frame.index)
+    invalid = {}
+    for column in FEATURE_COLUMNS:
+        raw = frame[column]
+        if column in CATEGORICAL_VALUES:
+            values = raw.astype("string").str.strip().str.upper().map(CATEGORICAL_VALUES[column])
+            features[column] = values.astype(object).where(values.notna(), np.nan)
+        else:
+            features[column] = pd.to_numeric(raw, errors="coerce").astype(np.float64)
+        invalid[column] = int((features[column].isna() & raw.notna()).sum())
+    return features, invalid
+
+
+# --------------------
+# 评分：预处理只执行一次，概率与标签都由同一次 predict_proba 得到
+# --------------------
+class RiskScore(NamedTuple):
+    proba: np.ndarray      # (N,) 阳性（患病）概率
+    label: np.ndarray      # (N,) int8，proba >= threshold
+    features: np.ndarray   # (N, F) 预处理后的特征矩阵，可复用于解释
+
+
+def transform_features(model, features):
+    """
+    依次执行流水线中除最终估计器外的各步 transform，返回估计器的输入矩阵。
+    SMOTE 等采样步骤只在训练时生效，这里跳过（与 imblearn Pipeline 预测时的行为一致）。
+    """
+    X = features
+    for _, step in model.steps[:-1]:
+        if step is None or step == "passthrough" or hasattr(step, "fit_resample"):
+            continue
+        X = step.transform(X)
+    return X
+
+
+def score(model, features, threshold=DEFAULT_THRESHOLD):
+    """
+    一次预处理 + 一次 predict_proba 同时得到概率和按阈值判定的标签，
+    代替分别调用 model.predict_proba 与 model.predict（后者会把整条流水线再跑一遍）。
+    model 也可以是 compile_pipeline 生成的 FastScorer。
+    """
+    if isinstance(model, FastScorer):
+        return model.score(features, threshold)
+    X = transform_features(model, features)
+    proba = model.steps[-1][1].predict_proba(X)[:, 1]
+    return RiskScore(proba, (proba >= threshold).astype(np.int8), X)
+
+
+# --------------------
+# NumPy 快速评分：从已拟合的流水线中提取参数，绕开 sklearn / pandas 的逐次调用开销
+# --------------------
+class _Block(NamedTuple):
+    columns: list
+    fill: np.ndarray          # 填充值（SimpleImputer.statistics_），None 表示不填充
+    mean: np.ndarray          # StandardScaler
+    scale: np.ndarray
+    categories: list          # 每列保留的 one-hot 类别（已去掉 drop 的类别），None 表示数值块
+
+
+def _compile_block(transformer, columns):
+    steps = transformer.steps if hasattr(transformer, "steps") else [(None, transformer)]
+    fill = mean = scale = categories = None
+    for _, est in steps:
+        name = type(est).__name__
+        if est == "passthrough":
+            continue
+        if name == "SimpleImputer" and mean is None and categories is None and not est.add_indicator:
+            fill = np.asarray(est.statistics_)
+        elif name == "StandardScaler" and categories is None:
+            mean = est.mean_ if est.with_mean else np.zeros(len(columns))
+            scale = est.scale_ if est.with_std else np.ones(len(columns))
+        elif name == "OneHotEncoder" and mean is None and est.handle_unknown in ("ignore", "infrequent_if_exist") \
+                and getattr(est, "infrequent_categories_", None) is None:
+            drop_idx = est.drop_idx_ if est.drop_idx_ is not None else [None] * len(est.categories_)
+            categories = [np.array([c for j, c in enumerate(cats) if j != drop], dtype=object)
+                          for cats, drop in zip(est.categories_, drop_idx)]
+        else:
+            raise ValueError(f"Unsupported transformer for fast path: {name}")
+    return _Block(list(columns), fill, mean, scale, categories)
+
+
+class FastScorer:
+    """
+    与 best_model_pipeline.pkl 等价的纯 NumPy 评分器（由 compile_pipeline 生成）。
+
+    支持 ColumnTransformer(SimpleImputer / StandardScaler / OneHotEncoder) + 二分类 LogisticRegression；
+    输入可以是 DataFrame，也可以是 {列名: 标量或数组} 字典。
+    """
+
+    def __init__(self, blocks, coef, intercept):
+        self.blocks = blocks
+        self.coef = coef
+        self.intercept = intercept
+
+    def transform(self, features):
+        parts = []
+        for block in self.blocks:
+            if block.categories is None:
+                X = np.column_stack([np.asarray(features[c], dtype=np.float64).reshape(-1)
+                                     for c in block.columns])
+                if block.fill is not None:
+                    X = np.where(np.isnan(X), block.fill.astype(np.float64), X)
+                if block.mean is not None:
+                    X = (X - block.mean) / block.scale
+                parts.append(X)
+                continue
+
+            for i, column in enumerate(block.columns):
+                values = np.asarray(features[column], dtype=object).reshape(-1)
+                if block.fill is not None:
+                    values = np.where(pd.isna(values), block.fill[i], values)
+                parts.append((values[:, np.newaxis] == block.categories[i]).astype(np.float64))
+        return np.hstack(parts)
+
+    def predict_proba(self, features):
+        z = self.transform(features) @ self.coef + self.intercept
+        proba = 1.0 / (1.0 + np.exp(-z))
+        return np.column_stack([1.0 - proba, proba])
+
+    def score(self, features, threshold=DEFAULT_THRESHOLD):
+        X = self.transform(features)
+        proba = 1.0 / (1.0 + np.exp(-(X @ self.coef + self.intercept)))
+        return RiskScore(proba, (proba >= threshold).astype(np.int8), X)
+
+
+def compile_pipeline(model):
+    """
+    提取已拟合流水线的参数（填充值、标准化均值/尺度、one-hot 类别、逻辑回归系数），生成 FastScorer。
+    流水线包含不支持的步骤时抛出 ValueError，调用方应回退到 score(model, ...)。
+    """
+    steps = [step for _, step in model.steps[:-1]
+             if not (step is None or step == "passthrough" or hasattr(step, "fit_resample"))]
+    estimator = model.steps[-1][1]
+    if len(steps) != 1 or not hasattr(steps[0], "transformers_"):
+        raise ValueError("Fast path requires a single ColumnTransformer before the estimator")
+    if type(estimator).__name__ != "LogisticRegression" or len(estimator.classes_) != 2:
+        raise ValueError("Fast path requires a binary LogisticRegression estimator")
+
+    preprocessor = steps[0]
+    names_in = list(getattr(preprocessor, "feature_names_in_", FEATURE_COLUMNS))
+    blocks = []
+    for _, transformer, columns in preprocessor.transformers_:
+        if transformer == "drop" or len(columns) == 0:
+            continue
+        columns = [names_in[c] if isinstance(c, (int, np.integer)) else c for c in columns]
+        blocks.append(_compile_block(transformer, columns))
+    return FastScorer(blocks, estimator.coef_[0].astype(np.float64), float(estimator.intercept_[0]))
+
+
+def synthetic_features(n=1000, seed=0, missing_rate=0.05):
+    """在页面输入范围内随机生成特征（含缺失值和未见过的类别），用于一致性检查。"""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        "age": rng.integers(20, 90, n).astype(float),
+        "education": rng.integers(1, 5, n).astype(float),
+        "sex": rng.choice(["M", "F"], n).astype(object),
+        "is_smoking": rng.choice(["YES", "NO"], n).astype(object),
+        "cigsPerDay": rng.integers(0, 70, n).astype(float),
+        "BPMeds": rng.integers(0, 2, n).astype(float),
+        "prevalentStroke": rng.integers(0, 2, n).astype(float),
+        "prevalentHyp": rng.integers(0, 2, n).astype(float),
+        "diabetes": rng.integers(0, 2, n).astype(float),
+        "totChol": rng.uniform(100, 600, n),
+        "sysBP": rng.uniform(80, 300, n),
+        "diaBP": rng.uniform(40, 150, n),
+        "BMI": rng.uniform(15, 50, n),
+        "heartRate": rng.uniform(40, 150, n),
+        "glucose": rng.uniform(40, 400, n),
+    })
+    for column in FEATURE_COLUMNS:
+        frame.loc[rng.random(n) < missing_rate, column] = np.nan
+    frame.loc[rng.random(n) < missing_rate, "sex"] = "U"
+    return frame
+
+
+def check_fast_path(model, features=None, threshold=DEFAULT_THRESHOLD, atol=1e-9):
+    """
+    比较 FastScorer 与 sklearn 流水线的概率和标签。
+
+    Returns:
+        dict: {"ok", "rows", "max_abs_diff", "label_mismatches"}
+    """
+    features = synthetic_features() if features is None else features
+    scorer = compile_pipeline(model)
+    ref = score(model, features, threshold)
+    out = scorer.score(features, threshold)
+    max_diff = float(np.max(np.abs(ref.proba - out.proba))) if len(features) else 0.0
+    mismatches = int(np.sum(ref.label != out.label))
+    return {"ok": max_diff <= atol and mismatches == 0, "rows": len(features),
+            "max_abs_diff": max_diff, "label_mismatches": mismatches}
+
+
+# --------------------
+# 特征贡献解释：每位患者各原始特征对风险对数几率的贡献
+# --------------------
+# 逐行解释缓存：(模型参数指纹, 行内容哈希) -> (15,) 贡献向量
+_explanations = LRUCache(maxsize=100_000)
+# 模型对象 -> 参数指纹（弱引用，模型被回收后条目自动删除）
+_fingerprints = weakref.WeakKeyDictionary()
+
+
+def _model_fingerprint(model):
+    """模型参数的内容哈希；与 id(model) 不同，不会因对象回收后地址复用而指向别的模型。"""
+    fingerprint = _fingerprints.get(model)
+    if fingerprint is None:
+        fingerprint = joblib.hash(model)
+        _fingerprints[model] = fingerprint
+    return fingerprint
+
+
+def _output_features(model):
+    """预处理输出矩阵每一列对应的原始特征名。"""
+    if isinstance(model, FastScorer):
+        names = []
+        for block in model.blocks:
+            if block.categories is None:
+                names.extend(block.columns)
+            else:
+                for column, categories in zip(block.columns, block.categories):
+                    names.extend([column] * len(categories))
+        return names
+
+    # SMOTE 等采样步骤也有 get_feature_names_out（输出 x0…xN），必须与 transform_features 一样跳过
+    steps = [step for _, step in model.steps[:-1]
+             if hasattr(step, "get_feature_names_out") and not hasattr(step, "fit_resample")]
+    names = []
+    for name in steps[-1].get_feature_names_out():
+        name = name.split("__", 1)[-1]
+        matches = [c for c in FEATURE_COLUMNS if name == c or name.startswith(c + "_")]
+        names.append(max(matches, key=len))
+    return names
+
+
+def explain(model, features, X=None):
+    """
+    向量化计算整批输入的逐特征贡献，返回 (N, 15) DataFrame（列为 FEATURE_COLUMNS）。
+
+    - 线性模型（FastScorer / LogisticRegression）：精确贡献 coef * (x - 基线)，按原始特征汇总。
+      标准化后的数值特征基线为训练集均值（即 0）；one-hot 特征基线为参考类别（drop 的类别），
+      所有特征贡献之和 + 截距 = 该患者的风险对数几率。
+    - 树模型：使用 shap.TreeExplainer（可选依赖）。
+
+    Args:
+        X: 可选，score() 返回的 RiskScore.features，避免重复预处理
+    """
+    if X is None:
+        X = model.transform(features) if isinstance(model, FastScorer) else transform_features(model, features)
+    X = X.toarray() if hasattr(X, "toarray") else np.asarray(X, dtype=np.float64)
+
+    if isinstance(model, FastScorer):
+        values = X * model.coef
+    else:
+        estimator = model.steps[-1][1]
+        if hasattr(estimator, "coef_"):
+            values = X * estimator.coef_[0]
+        else:
+            try:
+                import shap
+            except ImportError as e:
+                # shap 为可选依赖（会引入 numba / llvmlite），只有树模型解释需要
+                raise ImportError("Explaining tree-based models requires the optional 'shap' package "
+                                  "(pip install shap)") from e
+
+            values = shap.TreeExplainer(estimator).shap_values(X)
+            if isinstance(values, list):
+                values = values[1]
+            elif np.ndim(values) == 3:
+                values = values[:, :, 1]
+
+    # (N, F_out) @ (F_out, 15) 指示矩阵 -> 按原始特征汇总
+    names = _output_features(model)
+    mapping = np.zeros((len(names), len(FEATURE_COLUMNS)))
+    mapping[np.arange(len(names)), [FEATURE_COLUMNS.index(n) for n in names]] = 1.0
+    return pd.DataFrame(np.asarray(values) @ mapping, columns=FEATURE_COLUMNS, index=features.index)
+
+
+def explain_cached(model, features, X=None):
+    """
+    带缓存的 explain：按行内容哈希查找，只对未缓存的行做一次向量化计算。
+    交互式页面上反复预测同一组输入时不再重复计算。
+    """
+    fingerprint = _model_fingerprint(model)
+    hashes = pd.util.hash_pandas_object(features[FEATURE_COLUMNS], index=False).to_numpy()
+    rows = [_explanations.get((fingerprint, h)) for h in hashes]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        subset = X[missing] if X is not None else None
+        computed = explain(model, features.iloc[missing], subset).to_numpy()
+        for i, row in zip(missing, computed):
+            _explanations.put((fingerprint, hashes[i]), row)
+            rows[i] = row
+    return pd.DataFrame(np.vstack(rows), columns=FEATURE_COLUMNS, index=features.index)
+
+
+# --------------------
+# What-if 敏感性分析：固定其余特征，在一个或两个特征的取值网格上一次性评分
+# --------------------
+def sensitivity_sweep(model, base, grid):
+    """
+    Args:
+        base: 单行输入（DataFrame 或 {列名: 标量} 字典）
+        grid: {特征名: 取值数组}，一个或两个特征
+    Returns:
+        (N1,) 或 (N1, N2) 风险概率数组，轴顺序与 grid 的键顺序一致
+    """
+    if not 1 <= len(grid) <= 2:
+        raise ValueError("Sensitivity sweep supports one or two features")
+
+    axes = [np.asarray(values, dtype=np.float64) for values in grid.values()]
+    mesh = np.meshgrid(*axes, indexing="ij")
+    n = mesh[0].size
+
+    batch = {}
+    for column in FEATURE_COLUMNS:
+        value = base[column]
+        value = value.iloc[0] if isinstance(value, pd.Series) else value
+        batch[column] = np.full(n, value, dtype=object if column in CATEGORICAL_VALUES else np.float64)
+    for column, values in zip(grid, mesh):
+        batch[column] = values.ravel()
+
+    # FastScorer 直接接受列字典；sklearn 流水线需要 DataFrame
+    features = batch if isinstance(model, FastScorer) else pd.DataFrame(batch, columns=FEATURE_COLUMNS)
+    return score(model, features).proba.reshape(mesh[0].shape)
+
+
+# --------------------
+# 分块读取
+# --------------------
+def iter_cohort(file_obj, name=None, chunk_size=10000):
+    """
+    按块读取 CSV 或 Parquet 队列文件（按文件扩展名判断），产出 DataFrame。
+    Parquet 需要 pyarrow。
+    """
+    name = name or getattr(file_obj, "name", str(file_obj))
+    if name.lower().endswith((".parquet", ".pq")):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(file_obj).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(file_obj, chunksize=chunk_size)
+
+
+# --------------------
+# 批量评分
+# --------------------
+def score_frame(model, frame, threshold=DEFAULT_THRESHOLD):
+    """对一个数据块评分：返回追加了风险概率与高风险标签两列的 DataFrame，以及无效值统计。"""
+    features, invalid = coerce_features(frame)
+    result = score(model, features, threshold)
+    out = frame.copy()
+    out[RISK_COLUMN] = result.proba
+    out[LABEL_COLUMN] = result.label
+    return out, invalid
+
+
+def score_cohort(model, chunks, output, threshold=DEFAULT_THRESHOLD):
+    """
+    逐块评分并把结果以 CSV 追加写入 output（文本或二进制文件对象），
+    每处理完一块产出一次累计进度 {"rows", "high_risk", "invalid"}。
+    """
+    wrapped = not isinstance(output, io.TextIOBase)
+    if wrapped:
+        output = io.TextIOWrapper(output, encoding="utf-8", newline="", write_through=True)
+
+    progress = {"rows": 0, "high_risk": 0, "invalid": dict.fromkeys(FEATURE_COLUMNS, 0)}
+    for i, chunk in enumerate(chunks):
+        scored, invalid = score_frame(model, chunk, threshold)
+        scored.to_csv(output, header=(i == 0), index=False)
+        progress["rows"] += len(scored)
+        progress["high_risk"] += int(scored[LABEL_COLUMN].sum())
+        for column, count in invalid.items():
+            progress["invalid"][column] += count
+        yield progress
+
+    if wrapped:
+        output.detach()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冠心病风险批量队列评分")
+    parser.add_argument("input", nargs="?", help="CSV 或 Parquet 队列文件")
+    parser.add_argument("-o", "--output", default="-", help="CSV 输出文件（默认标准输出）")
+    parser.add_argument("--model-path", default="config/best_model_pipeline.pkl")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="高风险判定阈值")
+    parser.add_argument("--fast", action="store_true", help="使用 NumPy 快速评分器")
+    parser.add_argument("--check-fast", action="store_true", help="只做快速评分器与流水线的一致性检查")
+    args = parser.parse_args(argv)
+
+    model = load_model(args.model_path)
+    if args.check_fast:
+        features = None
+        if args.input:
+            features, _ = coerce_features(next(iter_cohort(args.input, chunk_size=args.chunk_size)))
+        result = check_fast_path(model, features, args.threshold)
+        print(json.dumps(result, indent=2))
+        return 0 if result["ok"] else 1
+    if args.input is None:
+        parser.error("input is required")
+    if args.fast:
+        model = compile_pipeline(model)
+    start = time.perf_counter()
+    output = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    try:
+        progress = None
+        for progress in score_cohort(model, iter_cohort(args.input, chunk_size=args.chunk_size), output,
+                                     args.threshold):
+            print(f"{progress['rows']} rows scored", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if progress:
+        print(f"Done: {progress['rows']} rows, {progress['high_risk']} high risk, "
+              f"{time.perf_counter() - start:.1f} s, invalid values: "
+              f"{ {k: v for k, v in progress['invalid'].items() if v} }", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+# cmr_export.py
+# 分割掩码导出：查找表上色 PNG / 压缩 NPZ / NIfTI / H5 / 逐切片 PNG 压缩包
+import gzip
+import io
+import struct
+import zipfile
+
+import h5py
+import numpy as np
+from PIL import Image
+
+from .cmr_render import colorize_labels
+from .result_cache import LRUCache, array_digest
+
+# 导出字节缓存：(格式, 掩码摘要, spacing) -> bytes，页面重跑时不重复编码
+_export_cache = LRUCache(maxsize=16)
+
+
+def export_png(mask):
+    """单张切片伪彩色 PNG 字节。"""
+    buf = io.BytesIO()
+    Image.fromarray(colorize_labels(mask)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def export_png_zip(masks, prefix="slice"):
+    """整叠切片逐张上色后写入 zip（PNG 本身已压缩，zip 中不再压缩）。"""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for idx, color in enumerate(colorize_labels(masks)):
+            png = io.BytesIO()
+            Image.fromarray(color).save(png, format="PNG")
+            zf.writestr(f"{prefix}_{idx:03d}.png", png.getvalue())
+    return buf.getvalue()
+
+
+def export_npz(masks, **extra):
+    """原始标签堆栈（uint8）压缩 NPZ，键名 'label'。"""
+    buf = io.BytesIO()
+    np.savez_compressed(buf, label=masks.astype(np.uint8, copy=False), **extra)
+    return buf.getvalue()
+
+
+def export_h5(masks, spacing=None):
+    """原始标签堆栈写入 H5（数据集 'label'，gzip 压缩），可附带 spacing 属性。"""
+    buf = io.BytesIO()
+    with h5py.File(buf, "w") as f:
+        dset = f.create_dataset("label", data=masks.astype(np.uint8, copy=False),
+                                compression="gzip", chunks=(1,) + masks.shape[1:])
+        if spacing is not None:
+            dset.attrs["spacing"] = np.asarray(spacing, dtype=np.float32)
+    return buf.getvalue()
+
+
+def _nifti1_header(shape, spacing):
+    """最小 NIfTI-1 头（348 字节，uint8 数据，单位 mm，无空间变换）。"""
+    header = bytearray(348)
+    struct.pack_into("<i", header, 0, 348)                    # sizeof_hdr
+    dims = [len(shape)] + list(shape) + [1] * (7 - len(shape))
+    struct.pack_into("<8h", header, 40, *dims)                # dim
+    struct.pack_into("<hh", header, 70, 2, 8)                 # datatype=UINT8, bitpix
+    pixdim = [1.0] + list(spacing) + [1.0] * (7 - len(spacing))
+    struct.pack_into("<8f", header, 76, *pixdim)              # pixdim
+    struct.pack_into("<f", header, 108, 352.0)                # vox_offset
+    struct.pack_into("<f", header, 112, 1.0)                  # scl_slope
+    struct.pack_into("<B", header, 123, 2)                    # xyzt_units = mm
+    header[344:348] = b"n+1\0"                                # magic
+    return bytes(header)
+
+
+def export_nifti(masks, spacing=(1.0, 1.0, 1.0)):
+    """
+    标签堆栈导出为 gzip 压缩的单文件 NIfTI-1（.nii.gz）。
+
+    (N, H, W) 的 C 顺序数组按 NIfTI 约定（x 变化最快）写为 (W, H, N) 体积；
+    spacing 依次为 (列, 行, 层) 方向的体素尺寸 (mm)。
+    """
+    masks = np.ascontiguousarray(masks, dtype=np.uint8)
+    n, height, width = masks.shape
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+        gz.write(_nifti1_header((width, height, n), spacing))
+        gz.write(b"\0\0\0\0")  # 无扩展
+        gz.write(masks.data)
+    return buf.getvalue()
+
+
+
+def export_cached(fmt, masks, spacing=(1.0, 1.0, 1.0), digest=None):
+    """
+    按格式导出并缓存字节，同一掩码与 spacing 只编码一次。
+
+    Args:
+        fmt: "png"（masks 为单张切片）/ "png_zip" / "npz" / "nifti" / "h5"
+        digest: masks 的 array_digest，已算好时传入以免重复哈希整叠掩码
+    """
+    spacing = tuple(float(v) for v in spacing)
+    key = (fmt, digest or array_digest(masks), spacing)
+    data = _export_cache.get(key)
+    if data is None:
+        if fmt == "png":
+            data = export_png(masks)
+        elif fmt == "png_zip":
+            data = export_png_zip(masks)
+        elif fmt == "npz":
+            data = export_npz(masks, spacing=np.asarray(spacing, dtype=np.float32))
+        elif fmt == "nifti":
+            data = export_nifti(masks, spacing)
+        elif fmt == "h5":
+            data = export_h5(masks, spacing)
+        else:
+            raise ValueError(f"Unknown export format: {fmt!r}")
+        _export_cache.put(key, data)
+    return data
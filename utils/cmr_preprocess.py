@@ -0,0 +1,156 @@
+# cmr_preprocess.py
+# CMR h5 图像读取与预处理（只依赖 NumPy / OpenCV / h5py，不需要 TensorFlow）
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import cv2
+import h5py
+import numpy as np
+
+# cv2.resize 单次最多处理 512 个通道
+_CV_MAX_CHANNELS = 512
+
+
+def preprocess_stack(image, target_size=(256, 256), normalize=True, out=None):
+    """
+    向量化预处理：整叠切片一次性双线性缩放，并按切片归一化到 [0, 1]。
+
+    切片被视为同一张图像的多个通道，用一次 cv2.resize 完成缩放（半像素中心对齐，
+    与 tf.image.resize(method='bilinear') 一致）；归一化用 NumPy 广播原地完成。
+
+    Args:
+        image: (H, W) 或 (N, H, W) 数组
+        target_size: (height, width)
+        out: 可选，预分配的 (N, height, width, 1) float32 输出数组
+
+    Returns:
+        (N, height, width, 1) float32
+    """
+    stack = image[np.newaxis] if image.ndim == 2 else image
+    if stack.ndim != 3:
+        raise ValueError(f"Unsupported image shape: {image.shape}")
+
+    n = stack.shape[0]
+    height, width = target_size
+    if out is None:
+        out = np.empty((n, height, width, 1), dtype=np.float32)
+
+    # (N, H, W) -> (H, W, N)，按 512 通道一组缩放，结果直接写入输出数组
+    for start in range(0, n, _CV_MAX_CHANNELS):
+        chunk = np.ascontiguousarray(stack[start:start + _CV_MAX_CHANNELS].transpose(1, 2, 0), dtype=np.float32)
+        resized = cv2.resize(chunk, (width, height), interpolation=cv2.INTER_LINEAR)
+        out[start:start + chunk.shape[2], :, :, 0] = resized.reshape(height, width, -1).transpose(2, 0, 1)
+
+    if normalize:
+        out /= out.max(axis=(1, 2, 3), keepdims=True) + 1e-8
+    return out
+
+
+# --------------------
+# 读取单张 h5 图像（支持2D/3D）
+# --------------------
+def load_h5_data(file_obj, is_training=False, target_size=(256, 256), normalize=True):
+    """
+    读取 h5 文件中的 'image' 数据集并预处理。
+    三维数据返回 (H, W, 1) 切片列表，二维数据返回单个 (H, W, 1) 数组。
+    """
+    with h5py.File(file_obj, 'r') as f:  # 路径、Streamlit UploadedFile 或 BytesIO
+        image = f['image'][:]
+
+    volume = preprocess_stack(image, target_size=target_size, normalize=normalize)
+    if image.ndim == 3:
+        return list(volume), None
+    return volume[0], None
+
+
+def load_h5_volume(file_obj, target_size=(256, 256), normalize=True):
+    """读取 h5 图像并预处理为 (N, H, W, 1) float32 体数据；二维图像视为 N=1。"""
+    with h5py.File(file_obj, 'r') as f:
+        image = f['image'][:]
+    return preprocess_stack(image, target_size=target_size, normalize=normalize)
+
+
+# --------------------
+# 大文件流式读取
+# --------------------
+def spool_to_disk(file_obj, chunk_size=1 << 20):
+    """
+    把上传文件分块写入磁盘临时文件，返回临时文件路径（由调用方负责删除）。
+    h5py 随后按需从磁盘读取，不再整体驻留内存。
+    """
+    file_obj.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".h5", delete=False) as tmp:
+        shutil.copyfileobj(file_obj, tmp, chunk_size)
+    return tmp.name
+
+
+@contextmanager
+def spool_upload(file_obj, chunk_size=1 << 20):
+    """spool_to_disk 的上下文管理器版本，退出时删除临时文件；传入路径时直接返回该路径。"""
+    if isinstance(file_obj, (str, os.PathLike)):
+        yield os.fspath(file_obj)
+        return
+
+    path = spool_to_disk(file_obj, chunk_size)
+    try:
+        yield path
+    finally:
+        os.remove(path)
+
+
+def h5_volume_shape(file_obj, dataset="image"):
+    """只读取元数据：返回 'image' 数据集形状，不加载像素。"""
+    with h5py.File(file_obj, 'r') as f:
+        return f[dataset].shape
+
+
+def read_h5_slice(file_obj, index, target_size=(256, 256), normalize=True, dataset="image"):
+    """只读取并预处理第 index 张切片（四维数据按 T×S 展平计数），返回 (H, W, 1) float32。"""
+    with h5py.File(file_obj, 'r') as f:
+        data = f[dataset]
+        if data.ndim == 2:
+            image = data[()]
+        elif data.ndim == 3:
+            image = data[index]
+        elif data.ndim == 4:
+            image = data[divmod(index, data.shape[1])]
+        else:
+            raise ValueError(f"Unsupported image shape: {data.shape}")
+    return preprocess_stack(image, target_size=target_size, normalize=normalize)[0]
+
+
+def _slice_ranges(shape, chunk_size):
+    """把 (H, W) / (S, H, W) / (T, S, H, W) 数据集划分为切片块索引（不跨越第一维）。"""
+    if len(shape) == 2:
+        yield ()
+    elif len(shape) == 3:
+        for start in range(0, shape[0], chunk_size):
+            yield (slice(start, min(start + chunk_size, shape[0])),)
+    elif len(shape) == 4:
+        for t in range(shape[0]):
+            for start in range(0, shape[1], chunk_size):
+                yield (t, slice(start, min(start + chunk_size, shape[1])))
+    else:
+        raise ValueError(f"Unsupported image shape: {shape}")
+
+
+def iter_h5_chunks(file_obj, chunk_size=16, target_size=(256, 256), normalize=True, dataset="image"):
+    """
+    惰性逐块读取并预处理 h5 图像，适用于大于内存的数据集。
+
+    每次只从文件读取 chunk_size 张切片（h5py 超平面读取），预处理后产出；
+    四维 (T, S, H, W) cine 数据按 T×S 展平为连续切片序号。
+
+    Yields:
+        (起始切片序号, (n, height, width, 1) float32)
+    """
+    with h5py.File(file_obj, 'r') as f:
+        data = f[dataset]
+        index = 0
+        for selection in _slice_ranges(data.shape, chunk_size):
+            chunk = data[selection] if selection else data[()]
+            out = preprocess_stack(chunk, target_size=target_size, normalize=normalize)
+            yield index, out
+            index += len(out)
@@ -0,0 +1,120 @@
+# cmr_quant.py
+# 基于分割掩码的心室容积 / 射血分数 / 心肌质量定量（纯 NumPy 归约）
+import h5py
+import numpy as np
+
+# 类别标签（ACDC 约定）
+CLASS_NAMES = {0: "Background", 1: "RV", 2: "MYO", 3: "LV"}
+RV, MYO, LV = 1, 2, 3
+
+# 心肌组织密度 (g/ml)
+MYOCARDIUM_DENSITY = 1.05
+
+_SPACING_KEYS = ("pixel_spacing", "spacing", "PixelSpacing")
+_THICKNESS_KEYS = ("slice_thickness", "SliceThickness", "thickness")
+
+
+def slice_class_counts(masks, num_classes=4):
+    """
+    统计每张切片中各类别像素数。
+
+    Args:
+        masks: (N, H, W) 整数掩码
+    Returns:
+        (N, num_classes) int64，列顺序见 CLASS_NAMES
+    """
+    n = masks.shape[0]
+    flat = masks.reshape(n, -1).astype(np.int64) + np.arange(n)[:, np.newaxis] * num_classes
+    return np.bincount(flat.ravel(), minlength=n * num_classes).reshape(n, num_classes)
+
+
+def _find_value(f, keys):
+    for obj in (f, f.get("image")):
+        if obj is None:
+            continue
+        for key in keys:
+            if key in obj.attrs:
+                return np.asarray(obj.attrs[key], dtype=np.float64)
+            if isinstance(obj, h5py.Group) and key in obj:
+                return np.asarray(obj[key][()], dtype=np.float64)
+    return None
+
+
+def read_h5_geometry(file_obj, dataset="image"):
+    """
+    从 h5 文件属性或数据集中读取像素间距与层厚（mm）。
+
+    Returns:
+        dict: {"shape": 原始数据集形状, "pixel_spacing": (行, 列) 或 None, "slice_thickness": float 或 None}
+    """
+    with h5py.File(file_obj, 'r') as f:
+        spacing = _find_value(f, _SPACING_KEYS)
+        thickness = _find_value(f, _THICKNESS_KEYS)
+        shape = f[dataset].shape
+
+    if spacing is not None:
+        spacing = np.atleast_1d(spacing).ravel()
+        # 部分文件存储 (x, y, z)：取前两维为像素间距，第三维可作为层厚
+        if thickness is None and spacing.size >= 3:
+            thickness = spacing[2]
+        spacing = (float(spacing[0]), float(spacing[1] if spacing.size > 1 else spacing[0]))
+    if thickness is not None:
+        thickness = float(np.atleast_1d(thickness).ravel()[0])
+    return {"shape": shape, "pixel_spacing": spacing, "slice_thickness": thickness}
+
+
+def quantify_volumes(masks, n_phases, pixel_spacing, slice_thickness, original_size=None):
+    """
+    由整叠分割掩码计算 LV / RV / MYO 容积、ED / ES 时相、射血分数和心肌质量。
+
+    Args:
+        masks: (T*S, H, W) 掩码堆栈，按 时相 × 切片 顺序排列（即 iter_h5_chunks 的展平顺序）
+        n_phases: 时相数 T
+        pixel_spacing: 原始图像 (行, 列) 像素间距 mm
+        slice_thickness: 层厚 mm（含层间距）
+        original_size: 原始图像 (H, W)；掩码经缩放时用于换算像素间距
+
+    Returns:
+        dict:
+            volumes_ml: {"LV": (T,), "RV": (T,), "MYO": (T,)}
+            ed_phase / es_phase: 舒张末期 / 收缩末期时相（LV 容积最大 / 最小）
+            LV_EDV / LV_ESV / LV_EF: 取 ED / ES 时相的 LV 容积
+            RV_EDV / RV_ESV / RV_EF: 取 RV 自身容积最大 / 最小的时相
+            只有一个时相（T == 1）时无法区分 ED / ES，ESV 与 EF 为 NaN
+            MYO_mass_g: ED 时相心肌容积 × 1.05 g/ml
+    """
+    n, height, width = masks.shape
+    if n % n_phases:
+        raise ValueError(f"{n} slices cannot be split into {n_phases} phases")
+
+    row_mm, col_mm = pixel_spacing
+    if original_size is not None:
+        row_mm *= original_size[0] / height
+        col_mm *= original_size[1] / width
+    voxel_ml = row_mm * col_mm * slice_thickness / 1000.0
+
+    # (T*S, C) -> (T, S, C) -> 每个时相各类别体素数 (T, C)
+    counts = slice_class_counts(masks).reshape(n_phases, n // n_phases, -1).sum(axis=1)
+    volumes = counts * voxel_ml
+
+    lv, rv, myo = volumes[:, LV], volumes[:, RV], volumes[:, MYO]
+    ed, es = int(np.argmax(lv)), int(np.argmin(lv))
+
+    def ejection_fraction(edv, esv):
+        return float((edv - esv) / edv * 100) if edv > 0 and n_phases > 1 else float("nan")
+
+    def end_systolic(value):
+        return float(value) if n_phases > 1 else float("nan")
+
+    return {
+        "volumes_ml": {"LV": lv, "RV": rv, "MYO": myo},
+        "ed_phase": ed,
+        "es_phase": es,
+        "LV_EDV": float(lv[ed]),
+        "LV_ESV": end_systolic(lv[es]),
+        "LV_EF": ejection_fraction(lv[ed], lv[es]),
+        "RV_EDV": float(rv.max()),
+        "RV_ESV": end_systolic(rv.min()),
+        "RV_EF": ejection_fraction(rv.max(), rv.min()),
+        "MYO_mass_g": float(myo[ed] * MYOCARDIUM_DENSITY),
+    }
@@ -0,0 +1,101 @@
+# cmr_render.py
+# CMR 分割结果渲染：直接用 NumPy 合成原图 / 掩码 / 叠加图，不创建 matplotlib 图形
+import io
+
+import numpy as np
+from matplotlib import colormaps
+from PIL import Image
+
+from .result_cache import LRUCache, array_digest
+
+
+def _jet_lut(n=256):
+    """从 matplotlib 的 jet 色图采样 (n, 3) uint8 查找表（只在导入时采样一次，不创建图形）。"""
+    return (colormaps["jet"](np.linspace(0.0, 1.0, n))[:, :3] * 255).round().astype(np.uint8)
+
+
+JET_LUT = _jet_lut()
+
+# 类别标签 -> RGB 查找表：固定 vmax=3，0-3 与页面图例（jet）一致，超出范围的标签按最大类别着色。
+# 页面展示与下载导出（cmr_export）共用，颜色不随单张掩码包含哪些类别而变化。
+LABEL_LUT = JET_LUT[np.minimum(np.arange(256) * 85, 255)]
+
+_png_cache = LRUCache(maxsize=128)
+
+
+def to_gray_uint8(image):
+    """(..., H, W) 或 (..., H, W, 1) 图像按整体最小/最大值线性拉伸到 uint8 灰度。"""
+    image = np.asarray(image)
+    if image.shape[-1] == 1:
+        image = image[..., 0]
+    if image.dtype == np.uint8:
+        return image
+    lo, hi = float(image.min()), float(image.max())
+    scale = 255.0 / (hi - lo) if hi > lo else 0.0
+    return ((image - lo) * scale).astype(np.uint8)
+
+
+def colorize_labels(masks, lut=LABEL_LUT):
+    """
+    uint8 类别标签 -> RGB，一次查表完成，不产生浮点中间数组。
+    支持任意前导维度，返回 (..., H, W, 3) uint8。
+    """
+    return lut[masks.astype(np.uint8, copy=False)]
+
+
+def overlay(gray, color, alpha=0.5):
+    """灰度图与伪彩色掩码按 alpha 混合，返回 uint8 RGB。"""
+    blended = gray[..., np.newaxis] * (1 - alpha) + color * alpha
+    return blended.astype(np.uint8)
+
+
+def compose_triptych(image, mask, gap=8):
+    """原图 / 掩码 / 叠加图横向拼接为一张 (H, 3W + 2*gap, 3) uint8 图像。"""
+    gray = to_gray_uint8(image)
+    color = colorize_labels(mask)
+    spacer = np.full((gray.shape[0], gap, 3), 255, dtype=np.uint8)
+    gray_rgb = np.repeat(gray[..., np.newaxis], 3, axis=-1)
+    return np.concatenate([gray_rgb, spacer, color, spacer, overlay(gray, color)], axis=1)
+
+
+def encode_png(array):
+    buf = io.BytesIO()
+    Image.fromarray(array).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def render_triptych_png(image, mask):
+    """三联图 PNG 字节，按 (图像, 掩码) 内容哈希缓存，页面重跑时不重复编码。"""
+    key = ("triptych", array_digest(image, mask))
+    png = _png_cache.get(key)
+    if png is None:
+        png = encode_png(compose_triptych(image, mask))
+        _png_cache.put(key, png)
+    return png
+
+
+def render_thumbnail_grid_png(volume, masks, cols=6, step=2):
+    """
+    整叠切片的叠加图缩略图网格 PNG（每隔 step 个像素取样缩小），按内容哈希缓存。
+
+    Args:
+        volume: (N, H, W) 或 (N, H, W, 1) 图像堆栈
+        masks: (N, H, W) 掩码堆栈
+    """
+    key = ("grid", cols, step, array_digest(volume, masks))
+    png = _png_cache.get(key)
+    if png is not None:
+        return png
+
+    gray = to_gray_uint8(volume)[:, ::step, ::step]
+    thumbs = overlay(gray, colorize_labels(masks[:, ::step, ::step]))
+    n, h, w, _ = thumbs.shape
+    rows = -(-n // cols)
+    grid = np.full((rows * cols, h, w, 3), 255, dtype=np.uint8)
+    grid[:n] = thumbs
+    # (rows*cols, h, w, 3) -> (rows, h, cols, w, 3) -> (rows*h, cols*w, 3)
+    grid = grid.reshape(rows, cols, h, w, 3).transpose(0, 2, 1, 3, 4).reshape(rows * h, cols * w, 3)
+
+    png = encode_png(grid)
+    _png_cache.put(key, png)
+    return png
@@ -0,0 +1,101 @@
+# cmr_segment.py
+# CMR 图像分割：h5 读取预处理 + DUCK-Net (Keras) 推理
+import os
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+from .cmr_preprocess import load_h5_data, load_h5_volume, preprocess_stack
+from .cmr_quant import CLASS_NAMES, slice_class_counts
+
+# 进程级模型缓存：(模型文件绝对路径, 文件 mtime) -> 已加载并预热的 Keras 模型
+_MODELS = {}
+_LOCK = threading.Lock()
+
+
+# --------------------
+# 模型加载: Keras 版本
+# --------------------
+def load_model(model_path):
+    return tf.keras.models.load_model(model_path)
+
+
+def get_segmentation_model(model_path, input_shape=(256, 256, 1)):
+    """
+    获取已加载、已预热的 DUCK-Net 模型，同一进程内所有会话共享一份。
+
+    预热时用空白 256×256 输入跑一次 predict，提前完成计算图构建；
+    之后多个会话并发调用 predict 是安全的。模型文件被替换（mtime 改变）后自动重新加载。
+    """
+    path = os.path.abspath(model_path)
+    key = (path, os.path.getmtime(path))
+    model = _MODELS.get(key)
+    if model is not None:
+        return model
+
+    with _LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            model = load_model(path)
+            model.predict(np.zeros((1,) + tuple(input_shape), dtype=np.float32), verbose=0)
+            for old_key in [k for k in _MODELS if k[0] == path]:
+                del _MODELS[old_key]
+            _MODELS[key] = model
+    return model
+
+# --------------------
+# 模型推理
+# --------------------
+def predict_masks(model, batch):
+    """对 (N, H, W, 1) 批次推理，返回 (softmax 概率 (N, H, W, C), 掩码 (N, H, W))。"""
+    pred_logits = model.predict(batch, verbose=0)
+    pred_softmax = tf.nn.softmax(pred_logits, axis=-1).numpy()
+    pred_mask = np.argmax(pred_softmax, axis=-1)
+    return pred_softmax, pred_mask
+
+
+def run_inference(image_np, model_path):
+    if image_np.ndim != 3:
+        raise ValueError("Input image must be a single (H, W, 1) array.")
+
+    input_tensor = np.expand_dims(image_np, axis=0)
+    model = get_segmentation_model(model_path)
+
+    pred_softmax, pred_mask = predict_masks(model, input_tensor)
+
+    return pred_softmax[0], pred_mask[0]
+
+
+def run_inference_volume(volume, model_path, batch_size=8):
+    """
+    体数据模式：对 (N, H, W, 1) 切片堆栈按 batch_size 分批推理。
+
+    Returns:
+        pred_masks: (N, H, W) uint8 掩码堆栈
+        counts: (N, 4) 每张切片 Background / RV / MYO / LV 像素数
+    """
+    if volume.ndim != 4 or volume.shape[-1] != 1:
+        raise ValueError("Input volume must be a (N, H, W, 1) array.")
+    if batch_size < 1:
+        raise ValueError("batch_size must be >= 1")
+
+    model = get_segmentation_model(model_path)
+    pred_masks = np.empty(volume.shape[:3], dtype=np.uint8)
+    for start in range(0, len(volume), batch_size):
+        _, masks = predict_masks(model, volume[start:start + batch_size])
+        pred_masks[start:start + len(masks)] = masks
+
+    return pred_masks, slice_class_counts(pred_masks)
+
+
+def run_inference_stream(chunks, model_path, batch_size=8):
+    """
+    流式推理：逐块消费 iter_h5_chunks 产出的 (起始序号, 切片块)，
+    按 batch_size 推理后产出 (起始序号, (n, H, W) uint8 掩码)。
+    """
+    model = get_segmentation_model(model_path)
+    for index, chunk in chunks:
+        for start in range(0, len(chunk), batch_size):
+            _, masks = predict_masks(model, chunk[start:start + batch_size])
+            yield index + start, masks.astype(np.uint8)
@@ -0,0 +1,261 @@
+# cmr_tflite.py
+"""
+DUCK-Net 的 TFLite 推理后端（CPU 优化）。
+
+duck_net_model.h5 只在第一次使用时转换一次，生成的 .tflite 文件与 .h5 放在同一目录，
+之后直接由轻量解释器加载，不再经过 Keras model.predict：
+
+    python -m utils.cmr_tflite config/duck_net_model.h5 --quantization fp16 --check data.h5
+
+解释器按以下顺序查找（均为可选依赖）：tflite_runtime -> ai_edge_litert -> tf.lite。
+装有 tflite_runtime 时推理进程完全不需要导入 TensorFlow；转换本身需要 TensorFlow。
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from .cmr_preprocess import load_h5_volume
+from .cmr_quant import CLASS_NAMES, slice_class_counts
+
+# None: fp32
+# fp16: 权重 float16 存储
+# dynamic: 权重 int8 动态范围量化，无需校准数据
+# int8: 权重与激活全 int8 量化，需要代表性数据集校准（输入输出仍为 float32）
+QUANTIZATIONS = (None, "fp16", "dynamic", "int8")
+# 页面 / 推理服务运行时可直接选择的量化方式（int8 需先用命令行 --calibration 离线转换）
+RUNTIME_QUANTIZATIONS = (None, "fp16", "dynamic")
+
+# 进程级解释器缓存：(tflite 绝对路径, mtime, num_threads) -> TFLiteSegmenter
+_MODELS = {}
+_LOCK = threading.Lock()
+# 转换串行进行，避免多个会话同时转换同一模型
+_CONVERT_LOCK = threading.Lock()
+
+
+def tflite_path(model_path, quantization=None):
+    """转换产物路径：duck_net_model.h5 -> duck_net_model[.fp16].tflite"""
+    root, _ = os.path.splitext(os.path.abspath(model_path))
+    return f"{root}.{quantization}.tflite" if quantization else f"{root}.tflite"
+
+
+# --------------------
+# 模型转换（需要 TensorFlow）
+# --------------------
+def convert_to_tflite(model_path, quantization=None, representative_data=None, out_path=None, force=False):
+    """
+    把 Keras .h5 模型转换为 TFLite 文件并返回其路径。
+
+    产物比 .h5 新时直接复用，不重复转换。
+
+    Args:
+        quantization: 见 QUANTIZATIONS
+        representative_data: int8 量化用的 (N, H, W, 1) float32 校准切片
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization!r}, expected one of {QUANTIZATIONS}")
+    out_path = out_path or tflite_path(model_path, quantization)
+    if not force and _is_fresh(out_path, model_path):
+        return out_path
+    if quantization == "int8" and representative_data is None:
+        raise ValueError("int8 quantization requires representative_data; convert offline with "
+                         "'python -m utils.cmr_tflite --quantization int8 --calibration <h5>'")
+
+    with _CONVERT_LOCK:
+        # 等锁期间可能已由其他会话转换完成
+        if not force and _is_fresh(out_path, model_path):
+            return out_path
+        _convert(model_path, quantization, representative_data, out_path)
+    return out_path
+
+
+def _is_fresh(out_path, model_path):
+    return os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(model_path)
+
+
+def _convert(model_path, quantization, representative_data, out_path):
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        def representative_dataset():
+            for image in representative_data:
+                yield [np.asarray(image, dtype=np.float32)[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+
+    # 写入同目录下的唯一临时文件后原子替换：其他进程同时转换也不会读到或留下半个文件
+    fd, tmp_path = tempfile.mkstemp(suffix=".tflite.tmp", dir=os.path.dirname(out_path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(converter.convert())
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+# --------------------
+# 轻量解释器
+# --------------------
+def _interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteSegmenter:
+    """
+    TFLite 解释器封装，predict(batch) 与 Keras model.predict 输出相同的 logits。
+
+    解释器本身不是线程安全的，多个会话并发调用时串行执行；
+    输入批大小变化时才重新 allocate_tensors。
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = _interpreter_class()(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = self._input["shape"][0]
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output["index"]).copy()
+
+
+def get_tflite_segmenter(model_path, quantization=None, num_threads=None):
+    """
+    获取（必要时转换并加载）DUCK-Net 的 TFLite 解释器，同一进程内共享一份。
+
+    model_path 为 .h5 时先转换（已转换则复用）；也可以直接传入 .tflite 文件。
+    """
+    if model_path.endswith(".tflite"):
+        path = os.path.abspath(model_path)
+    else:
+        path = convert_to_tflite(model_path, quantization)
+    key = (path, os.path.getmtime(path), num_threads)
+    segmenter = _MODELS.get(key)
+    if segmenter is not None:
+        return segmenter
+
+    with _LOCK:
+        segmenter = _MODELS.get(key)
+        if segmenter is None:
+            segmenter = TFLiteSegmenter(path, num_threads=num_threads)
+            segmenter.predict(np.zeros((1,) + tuple(segmenter._input["shape"][1:]), dtype=np.float32))
+            for old_key in [k for k in _MODELS if k[0] == path]:
+                del _MODELS[old_key]
+            _MODELS[key] = segmenter
+    return segmenter
+
+
+# --------------------
+# 模型推理（接口与 cmr_segment 一致）
+# --------------------
+def predict_masks(segmenter, batch):
+    """对 (N, H, W, 1) 批次推理，返回 (softmax 概率 (N, H, W, C), 掩码 (N, H, W))。"""
+    logits = segmenter.predict(batch)
+    # softmax 单调，掩码直接取 logits 的 argmax
+    pred_mask = np.argmax(logits, axis=-1)
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True), pred_mask
+
+
+def run_inference(image_np, model_path, quantization=None):
+    if image_np.ndim != 3:
+        raise ValueError("Input image must be a single (H, W, 1) array.")
+
+    segmenter = get_tflite_segmenter(model_path, quantization)
+    pred_softmax, pred_mask = predict_masks(segmenter, image_np[np.newaxis])
+    return pred_softmax[0], pred_mask[0]
+
+
+def run_inference_stream(chunks, model_path, batch_size=8, quantization=None):
+    """流式推理：同 cmr_segment.run_inference_stream，只计算掩码。"""
+    segmenter = get_tflite_segmenter(model_path, quantization)
+    for index, chunk in chunks:
+        for start in range(0, len(chunk), batch_size):
+            logits = segmenter.predict(chunk[start:start + batch_size])
+            yield index + start, np.argmax(logits, axis=-1).astype(np.uint8)
+
+
+# --------------------
+# 精度一致性检查：TFLite vs Keras
+# --------------------
+def dice_per_class(ref_masks, masks, num_classes=4):
+    """逐类别 Dice（两者均为空的类别记为 1.0），跳过背景。"""
+    ref_counts = slice_class_counts(ref_masks, num_classes).sum(axis=0)
+    counts = slice_class_counts(masks, num_classes).sum(axis=0)
+    both = np.where(ref_masks == masks, ref_masks, num_classes)
+    inter = np.bincount(both.ravel().astype(np.int64), minlength=num_classes + 1)[:num_classes]
+    total = ref_counts + counts
+    dice = np.where(total > 0, 2 * inter / np.maximum(total, 1), 1.0)
+    return {CLASS_NAMES[c]: float(dice[c]) for c in range(1, num_classes)}
+
+
+def check_parity(volume, model_path="config/duck_net_model.h5", quantization=None,
+                 batch_size=8, min_dice=0.98):
+    """
+    在样例切片上比较 TFLite 后端与 Keras 模型的分割掩码。
+
+    Args:
+        volume: (N, H, W, 1) float32 预处理后的切片
+    Returns:
+        dict: {"ok": bool, "quantization", "dice": {类别: Dice}}，所有类别 Dice >= min_dice 时 ok
+    """
+    from .cmr_segment import run_inference_volume
+
+    ref_masks, _ = run_inference_volume(volume, model_path, batch_size=batch_size)
+    segmenter = get_tflite_segmenter(model_path, quantization)
+    masks = np.empty_like(ref_masks)
+    for start in range(0, len(volume), batch_size):
+        logits = segmenter.predict(volume[start:start + batch_size])
+        masks[start:start + len(logits)] = np.argmax(logits, axis=-1)
+
+    dice = dice_per_class(ref_masks, masks)
+    return {"ok": min(dice.values()) >= min_dice, "quantization": quantization, "dice": dice}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DUCK-Net 转换为 TFLite，并与 Keras 输出做 Dice 一致性检查")
+    parser.add_argument("model_path", nargs="?", default="config/duck_net_model.h5")
+    parser.add_argument("--quantization", default=None, choices=[q for q in QUANTIZATIONS if q])
+    parser.add_argument("--calibration", help="int8 量化校准用 h5 文件（'image' 数据集）")
+    parser.add_argument("--check", help="一致性检查用 h5 文件（'image' 数据集）")
+    parser.add_argument("--min-dice", type=float, default=0.98)
+    parser.add_argument("--force", action="store_true", help="忽略已有产物，重新转换")
+    args = parser.parse_args()
+
+    calibration = load_h5_volume(args.calibration) if args.calibration else None
+    path = convert_to_tflite(args.model_path, args.quantization, calibration, force=args.force)
+    print(f"TFLite model: {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+
+    if args.check:
+        result = check_parity(load_h5_volume(args.check), args.model_path, args.quantization,
+                              min_dice=args.min_dice)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        raise SystemExit(0 if result["ok"] else 1)
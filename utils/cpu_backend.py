@@ -0,0 +1,161 @@
+# cpu_backend.py
+import argparse
+import copy
+import json
+import sys
+
+import torch
+from torch import nn
+from torchvision import transforms
+from torchvision.ops import box_iou
+from PIL import Image
+
+# eager: 原始 fp32 模型
+# quantized: 检测头（box_head / box_predictor 中的 Linear 层）动态 int8 量化
+# script: TorchScript 脚本化
+# compile: torch.compile
+BACKENDS = ("eager", "quantized", "script", "compile")
+
+
+class _ScriptedDetector(nn.Module):
+    """TorchScript 下检测模型返回 (losses, detections)，这里只取 detections，保持与 eager 一致。"""
+
+    def __init__(self, scripted):
+        super().__init__()
+        self.scripted = scripted
+
+    def forward(self, images):
+        return self.scripted(images)[1]
+
+
+def optimize_detector(model, backend="eager"):
+    """
+    将已加载 checkpoint、处于 eval 模式的检测模型转换为指定推理后端。
+    quantized 仅支持 CPU。
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend!r}, expected one of {BACKENDS}")
+
+    if backend == "eager":
+        return model
+    if backend == "quantized":
+        if next(model.parameters()).device.type != "cpu":
+            raise ValueError("Dynamic int8 quantization is only supported on CPU.")
+        return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+    if backend == "script":
+        return _ScriptedDetector(torch.jit.script(model)).eval()
+    return torch.compile(model)
+
+
+def set_num_threads(num_threads):
+    """设置 PyTorch CPU 计算线程数（进程级生效）；None 表示保持默认。"""
+    if num_threads is not None and num_threads != torch.get_num_threads():
+        torch.set_num_threads(int(num_threads))
+
+
+# --------------------
+# 精度一致性检查：优化后端 vs fp32 eager
+# --------------------
+def _match_outputs(ref, out, iou_threshold=0.5):
+    ref_boxes, ref_scores = ref["boxes"], ref["scores"]
+    out_boxes, out_scores = out["boxes"], out["scores"]
+    if len(ref_boxes) == 0 or len(out_boxes) == 0:
+        return {"matched": 0, "mean_iou": None, "max_score_diff": None}
+
+    # 每个参考框匹配 IoU 最大的优化后端框
+    ious, idx = box_iou(ref_boxes, out_boxes).max(dim=1)
+    hit = ious >= iou_threshold
+    if not hit.any():
+        return {"matched": 0, "mean_iou": None, "max_score_diff": None}
+    score_diff = (ref_scores[hit] - out_scores[idx[hit]]).abs()
+    return {
+        "matched": int(hit.sum()),
+        "mean_iou": float(ious[hit].mean()),
+        "max_score_diff": float(score_diff.max()),
+    }
+
+
+def _compare(ref, out, min_iou, max_score_diff, min_match_rate=1.0):
+    item = {"ref_count": len(ref["scores"]), "count": len(out["scores"])}
+    item.update(_match_outputs(ref, out))
+    item["ok"] = (
+        item["matched"] >= min_match_rate * item["ref_count"]
+        and (item["mean_iou"] is None or item["mean_iou"] >= min_iou)
+        and (item["max_score_diff"] is None or item["max_score_diff"] <= max_score_diff)
+    )
+    return item
+
+
+def check_parity(image_paths, model_path="config/faster_rcnn.pth", backend="quantized",
+                 score_threshold=0.7, raw_threshold=0.05, top_k=20,
+                 min_iou=0.9, max_score_diff=0.05, min_match_rate=0.9):
+    """
+    在样例造影图像上比较优化后端与 fp32 eager 模型的检测框和得分。
+
+    - displayed：得分 >= score_threshold 的框（页面实际展示的框），要求数量一致且全部匹配
+    - raw：参考模型得分 >= raw_threshold 的前 top_k 个原始输出框，与优化后端得分 >= raw_threshold
+      的全部框匹配，匹配率 >= min_match_rate；即使没有框达到展示阈值也能比较到模型输出
+    匹配框的平均 IoU >= min_iou、得分差 <= max_score_diff。
+
+    所有图像上参考模型都没有任何原始输出框时判定失败（没有实际比较任何东西）。
+
+    Returns:
+        dict: {"ok": bool, "backend", "ref_boxes": 参与比较的参考框总数, "warnings": [...], "images": [...]}
+    """
+    from .model_registry import get_detector
+
+    device = torch.device("cpu")
+    ref_model = get_detector(model_path, device, backend="eager")
+    opt_model = get_detector(model_path, device, backend=backend)
+    transform = transforms.Compose([transforms.ToTensor()])
+
+    report = []
+    ok = True
+    raw_total = displayed_total = 0
+    for path in image_paths:
+        image_tensor = transform(Image.open(path).convert("RGB"))
+        with torch.no_grad():
+            ref = ref_model([image_tensor])[0]
+            out = opt_model([image_tensor])[0]
+
+        # 输出已按得分降序排列
+        ref_raw = {k: v[ref["scores"] >= raw_threshold][:top_k] for k, v in ref.items()}
+        out_raw = {k: v[out["scores"] >= raw_threshold] for k, v in out.items()}
+        ref_shown = {k: v[ref["scores"] >= score_threshold] for k, v in ref.items()}
+        out_shown = {k: v[out["scores"] >= score_threshold] for k, v in out.items()}
+
+        raw = _compare(ref_raw, out_raw, min_iou, max_score_diff, min_match_rate)
+        displayed = _compare(ref_shown, out_shown, min_iou, max_score_diff)
+        displayed["ok"] = displayed["ok"] and displayed["ref_count"] == displayed["count"]
+
+        item = {"image": path, "raw": raw, "displayed": displayed, "ok": raw["ok"] and displayed["ok"]}
+        raw_total += raw["ref_count"]
+        displayed_total += displayed["ref_count"]
+        ok = ok and item["ok"]
+        report.append(item)
+
+    warnings = []
+    if raw_total == 0:
+        ok = False
+        warnings.append(f"Reference model produced no boxes >= {raw_threshold} on any image; nothing was compared.")
+    elif displayed_total == 0:
+        warnings.append(f"No reference boxes >= {score_threshold}; only raw outputs were compared. "
+                        "Use angiogram frames with visible stenoses.")
+
+    return {"ok": ok, "backend": backend, "ref_boxes": raw_total, "warnings": warnings, "images": report}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检测模型优化后端精度一致性检查")
+    parser.add_argument("images", nargs="+", help="样例造影帧路径（需含可检出的狭窄）")
+    parser.add_argument("--model-path", default="config/faster_rcnn.pth")
+    parser.add_argument("--backend", default="quantized", choices=BACKENDS[1:])
+    parser.add_argument("--num-threads", type=int, default=None)
+    args = parser.parse_args()
+
+    set_num_threads(args.num_threads)
+    result = check_parity(args.images, model_path=args.model_path, backend=args.backend)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    for warning in result["warnings"]:
+        print(f"WARNING: {warning}", file=sys.stderr)
+    raise SystemExit(0 if result["ok"] else 1)
@@ -0,0 +1,76 @@
+# detection.py
+# 检测结果结构与绘图（不依赖 PyTorch，可在不加载模型的进程中使用）
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+class Detection(NamedTuple):
+    """单张图像的原始检测结果（原图坐标，按得分降序）。"""
+    boxes: np.ndarray   # (N, 4) float32, x1 y1 x2 y2
+    scores: np.ndarray  # (N,) float32
+    labels: np.ndarray  # (N,) int32
+
+    def filter(self, score_threshold):
+        """保留得分 >= score_threshold 的检测框。"""
+        keep = self.scores >= score_threshold
+        return Detection(self.boxes[keep], self.scores[keep], self.labels[keep])
+
+
+def _box_outline_mask(boxes, height, width, line_width):
+    """
+    用二维差分 + 前缀和一次性生成所有检测框的边框掩码（外框减内框），
+    不需要逐框调用绘图函数。
+
+    与 ImageDraw.rectangle 一致，x2 / y2 所在的像素也属于边框：外框取半开区间 [x1, x2 + 1)。
+    """
+    diff = np.zeros((height + 1, width + 1), dtype=np.int32)
+    outer = np.round(boxes).astype(np.int64) + np.array([0, 0, 1, 1])
+    inner = outer + np.array([line_width, line_width, -line_width, -line_width])
+    for rects, sign in ((outer, 1), (inner, -1)):
+        x1 = np.clip(rects[:, 0], 0, width)
+        y1 = np.clip(rects[:, 1], 0, height)
+        x2 = np.clip(rects[:, 2], 0, width)
+        y2 = np.clip(rects[:, 3], 0, height)
+        valid = (x2 > x1) & (y2 > y1)
+        x1, y1, x2, y2 = x1[valid], y1[valid], x2[valid], y2[valid]
+        np.add.at(diff, (y1, x1), sign)
+        np.add.at(diff, (y1, x2), -sign)
+        np.add.at(diff, (y2, x1), -sign)
+        np.add.at(diff, (y2, x2), sign)
+    return diff.cumsum(axis=0).cumsum(axis=1)[:height, :width] > 0
+
+
+def render_detections(image: Image.Image, detection: Detection, score_threshold: float = 0.7,
+                      vectorized: bool = False, numbered: bool = True):
+    """
+    在图像副本上绘制保留的检测框：红框（得分 > 0.9）/ 橙框，并标注编号（与得分顺序一致）。
+
+    vectorized=True 时用 NumPy 一次性绘制全部边框，适合框数量很多的情况。
+    """
+    kept = detection.filter(score_threshold)
+    high = kept.scores > 0.9
+
+    if vectorized:
+        canvas = np.array(image.convert("RGB"))
+        height, width = canvas.shape[:2]
+        canvas[_box_outline_mask(kept.boxes[~high], height, width, 3)] = (255, 165, 0)
+        canvas[_box_outline_mask(kept.boxes[high], height, width, 3)] = (255, 0, 0)
+        result_img = Image.fromarray(canvas)
+    else:
+        result_img = image.copy()
+
+    if not numbered and vectorized:
+        return result_img
+
+    draw = ImageDraw.Draw(result_img)
+    for idx, (box, is_high) in enumerate(zip(kept.boxes.tolist(), high.tolist())):
+        x1, y1, x2, y2 = box
+        color = "red" if is_high else "orange"
+        if not vectorized:
+            draw.rectangle([x1, y1, x2, y2], outline=color, width=3)
+        if numbered:
+            draw.text((x1, y1 - 50), f"{idx + 1}", fill=color, font_size=40)
+
+    return result_img
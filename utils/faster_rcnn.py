@@ -3,8 +3,19 @@ from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
 from torchvision.models.detection import FasterRCNN_ResNet50_FPN_Weights
 
 weights = FasterRCNN_ResNet50_FPN_Weights.DEFAULT
-def get_faster_rcnn_model(num_classes=2):
+def get_faster_rcnn_model(num_classes=2, pretrained=True):
+    """
+    构建 Faster R-CNN (ResNet50-FPN) 检测模型。
+
+    pretrained=False 时只构建网络结构（weights=None, weights_backbone=None），
+    不下载、不加载任何 COCO / ImageNet 权重，适用于随后加载自有 checkpoint 的场景
+    （离线部署节点也能正常启动）。
+    """
+    if not pretrained:
+        return torchvision.models.detection.fasterrcnn_resnet50_fpn(
+            weights=None, weights_backbone=None, num_classes=num_classes)
+
     model = torchvision.models.detection.fasterrcnn_resnet50_fpn(weights=weights)
     in_features = model.roi_heads.box_predictor.cls_score.in_features
     model.roi_heads.box_predictor = FastRCNNPredictor(in_features, num_classes)
-    return model
\ No newline at end of file
+    return model
@@ -0,0 +1,308 @@
+# inference_server.py
+"""
+本地推理工作进程池：检测（PyTorch）与分割（TensorFlow/Keras）模型常驻在独立进程中。
+
+Streamlit 页面进程只负责提交任务和轮询结果，不需要导入任何深度学习框架；
+同一进程内多个会话共享一个 InferenceServer（通过 get_shared_server() 获取）。
+
+    server = InferenceServer().start()
+    job_id = server.submit("detect", {"image": np.asarray(image)})
+    result = server.poll(job_id)      # 未完成时返回 None
+    result = server.wait(job_id)      # 阻塞等待
+
+- 跨会话批处理：工作进程取到一个任务后，会在 batch_wait 秒内继续收集同类任务，
+  最多 max_batch 个一起推理。
+- 背压：每类任务的待处理队列长度有上限（max_pending），队列满时 submit 抛出 ServerBusy。
+"""
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+
+from .cmr_tflite import RUNTIME_QUANTIZATIONS
+
+TASKS = ("detect", "segment")
+
+
+class ServerBusy(RuntimeError):
+    """待处理任务过多，请稍后重试。"""
+
+
+# --------------------
+# 工作进程
+# --------------------
+def _load_handler(task, model_path, options):
+    """在工作进程内加载模型，返回批量处理函数 handler(payloads) -> results。"""
+    if task == "detect":
+        from PIL import Image
+        from .inference_single import detect
+
+        def handler(payloads):
+            # 推理参数相同的任务合并成一个批次
+            results = [None] * len(payloads)
+            groups = {}
+            for i, payload in enumerate(payloads):
+                groups.setdefault(payload.get("max_side"), []).append(i)
+            for max_side, indices in groups.items():
+                images = [Image.fromarray(payloads[i]["image"]).convert("RGB") for i in indices]
+                detections = detect(images, model_path=model_path, batch_size=len(images),
+                                    max_side=max_side, **options)
+                for i, detection in zip(indices, detections):
+                    results[i] = detection
+            return results
+
+        detect(Image.new("RGB", (256, 256)), model_path=model_path, use_cache=False, **options)
+        return handler
+
+    import numpy as np
+    if options.get("backend") == "tflite":
+        from .cmr_tflite import get_tflite_segmenter, predict_masks
+        model = get_tflite_segmenter(model_path, options.get("quantization"))
+    else:
+        from .cmr_segment import get_segmentation_model, predict_masks
+        model = get_segmentation_model(model_path)
+
+    def handler(payloads):
+        batch = np.stack([payload["image"] for payload in payloads]).astype(np.float32)
+        _, masks = predict_masks(model, batch)
+        return list(masks.astype(np.uint8))
+
+    return handler
+
+
+def _worker_main(task, model_path, options, jobs, results, max_batch, batch_wait):
+    try:
+        handler = _load_handler(task, model_path, options)
+    except Exception as e:
+        # 加载失败（checkpoint 缺失、框架导入失败等）时通知页面进程，而不是静默退出
+        results.put(("load_error", task, f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", task, None))
+    pid = os.getpid()
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        batch = [job]
+        deadline = time.monotonic() + batch_wait
+        stop = False
+        while len(batch) < max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = jobs.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                stop = True
+                break
+            batch.append(job)
+
+        # 登记本进程取走的任务，进程异常退出时页面端可以立即判定这些任务失败
+        results.put(("taken", pid, [job_id for job_id, _ in batch]))
+        try:
+            outputs = handler([payload for _, payload in batch])
+            for (job_id, _), output in zip(batch, outputs):
+                results.put((job_id, True, output))
+        except Exception as e:
+            for job_id, _ in batch:
+                results.put((job_id, False, f"{type(e).__name__}: {e}"))
+
+        if stop:
+            break
+
+
+# --------------------
+# 页面进程中的客户端
+# --------------------
+class InferenceServer:
+    def __init__(self, detection_model_path="config/faster_rcnn.pth",
+                 segmentation_model_path="config/duck_net_model.h5",
+                 detection_workers=1, segmentation_workers=1,
+                 max_pending=16, max_batch=8, batch_wait=0.05, detection_options=None,
+                 segmentation_options=None, result_ttl=300):
+        self.model_paths = {"detect": detection_model_path, "segment": segmentation_model_path}
+        self.num_workers = {"detect": detection_workers, "segment": segmentation_workers}
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.detection_options = detection_options or {}
+        self.segmentation_options = segmentation_options or {}
+        # 完成后超过 result_ttl 秒无人取走的结果被丢弃（例如 Streamlit 重跑打断了页面端的 wait）
+        self.result_ttl = result_ttl
+
+        # spawn：工作进程不继承 Streamlit 进程的线程和框架状态
+        self._ctx = mp.get_context("spawn")
+        self._jobs = {}
+        self._results_queue = None
+        self._processes = []
+        self._workers = {}       # task -> [Process]
+        self._results = {}       # job_id -> (ok, output, 完成时间)
+        self._owners = {}        # job_id -> 取走该任务的工作进程 pid
+        self._ready = set()
+        self._load_errors = {}   # task -> 模型加载错误信息
+        self._cond = threading.Condition()
+        self._ids = itertools.count()
+        self._collector = None
+
+    def start(self):
+        self._results_queue = self._ctx.Queue()
+        for task in TASKS:
+            if self.num_workers[task] <= 0:
+                continue
+            self._jobs[task] = self._ctx.Queue(maxsize=self.max_pending)
+            options = self.detection_options if task == "detect" else self.segmentation_options
+            for _ in range(self.num_workers[task]):
+                process = self._ctx.Process(
+                    target=_worker_main,
+                    args=(task, self.model_paths[task], options, self._jobs[task],
+                          self._results_queue, self.max_batch, self.batch_wait),
+                    daemon=True,
+                )
+                process.start()
+                self._processes.append(process)
+                self._workers.setdefault(task, []).append(process)
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        return self
+
+    def _collect(self):
+        while True:
+            message = self._results_queue.get()
+            if message is None:
+                break
+            job_id, ok, output = message
+            with self._cond:
+                if job_id == "ready":
+                    self._ready.add(ok)
+                elif job_id == "load_error":
+                    self._load_errors[ok] = output
+                elif job_id == "taken":
+                    for taken_id in output:
+                        self._owners[taken_id] = ok
+                else:
+                    now = time.monotonic()
+                    self._owners.pop(job_id, None)
+                    self._results[job_id] = (ok, output, now)
+                    for old_id in [k for k, v in self._results.items() if now - v[2] > self.result_ttl]:
+                        del self._results[old_id]
+                self._cond.notify_all()
+
+    def submit(self, task, payload, timeout=0):
+        """
+        提交任务，返回 job_id。
+
+        Args:
+            task: "detect"（payload: {"image": uint8 (H, W, 3), "max_side": 可选}）
+                  或 "segment"（payload: {"image": float32 (H, W, 1)}）
+            timeout: 队列满时最多等待的秒数，超时抛出 ServerBusy
+        """
+        if task not in self._jobs:
+            raise ValueError(f"No workers for task: {task!r}")
+        job_id = f"{task}-{next(self._ids)}"
+        try:
+            if timeout:
+                self._jobs[task].put((job_id, payload), timeout=timeout)
+            else:
+                self._jobs[task].put_nowait((job_id, payload))
+        except queue.Full:
+            raise ServerBusy(f"Too many pending {task} jobs, please retry later.")
+        return job_id
+
+    def poll(self, job_id):
+        """任务完成时返回结果（并从结果表中移除），未完成返回 None；任务失败抛出 RuntimeError。"""
+        with self._cond:
+            if job_id not in self._results:
+                return None
+            ok, output, _ = self._results.pop(job_id)
+        if not ok:
+            raise RuntimeError(output)
+        return output
+
+    def _check_workers(self, job_id):
+        """工作进程加载失败、全部退出，或取走该任务的进程已退出时抛出 RuntimeError。"""
+        task = job_id.split("-", 1)[0]
+        with self._cond:
+            if job_id in self._results:
+                return
+            if task in self._load_errors:
+                raise RuntimeError(f"{task} worker failed to load model: {self._load_errors[task]}")
+            owner = self._owners.get(job_id)
+        workers = self._workers.get(task, [])
+        if not any(p.is_alive() for p in workers):
+            codes = [p.exitcode for p in workers]
+            raise RuntimeError(f"All {task} workers have exited (exit codes: {codes})")
+        for process in workers:
+            if process.pid == owner and not process.is_alive():
+                raise RuntimeError(f"{task} worker {owner} exited with code {process.exitcode} "
+                                   f"while running job {job_id}")
+
+    def wait(self, job_id, timeout=None, interval=0.05):
+        """轮询直到任务完成；超时抛出 TimeoutError，工作进程失败或退出时立即抛出 RuntimeError。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            result = self.poll(job_id)
+            if result is not None:
+                return result
+            self._check_workers(job_id)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Job {job_id} did not finish in {timeout}s")
+            with self._cond:
+                self._cond.wait(interval)
+
+    def is_ready(self, task):
+        with self._cond:
+            return task in self._ready
+
+    def shutdown(self):
+        for task, jobs in self._jobs.items():
+            for _ in range(self.num_workers[task]):
+                jobs.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        if self._results_queue is not None:
+            self._results_queue.put(None)
+
+
+# --------------------
+# 进程级共享实例
+# --------------------
+SERVER_ENV = "CHR_INFERENCE_SERVER"
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def server_enabled():
+    """设置环境变量 CHR_INFERENCE_SERVER=1 时，页面通过工作进程池推理；否则在页面进程内推理。"""
+    return os.environ.get(SERVER_ENV, "") not in ("", "0")
+
+
+def get_shared_server():
+    """获取（必要时启动）进程内共享的 InferenceServer，所有 Streamlit 会话共用。"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            quantization = os.environ.get("CHR_SEGMENTATION_QUANTIZATION") or None
+            if quantization not in RUNTIME_QUANTIZATIONS:
+                raise ValueError(f"CHR_SEGMENTATION_QUANTIZATION={quantization!r} is not supported at runtime, "
+                                 f"expected one of {RUNTIME_QUANTIZATIONS[1:]} (convert int8 offline with "
+                                 f"'python -m utils.cmr_tflite --quantization int8 --calibration ...')")
+            _shared = InferenceServer(
+                detection_model_path=os.path.join(_ROOT_DIR, "config", "faster_rcnn.pth"),
+                segmentation_model_path=os.path.join(_ROOT_DIR, "config", "duck_net_model.h5"),
+                detection_workers=int(os.environ.get("CHR_DETECTION_WORKERS", 1)),
+                segmentation_workers=int(os.environ.get("CHR_SEGMENTATION_WORKERS", 1)),
+                segmentation_options={
+                    "backend": os.environ.get("CHR_SEGMENTATION_BACKEND", "keras"),
+                    "quantization": quantization,
+                },
+            ).start()
+        return _shared
@@ -1,55 +1,194 @@
 # inference_single.py
 import torch
 from torchvision import transforms
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 import numpy as np
-from .faster_rcnn import get_faster_rcnn_model
-import os
+from .detection import Detection, render_detections
+from .input_policy import downscale, merge_tile_detections, tile_regions
+from .model_registry import checkpoint_key, get_detector
+from .result_cache import detection_cache, image_digest
 
-def run_inference_on_image(image: Image.Image, model_path: str = "config/faster_rcnn.pth", score_threshold: float = 0.7):
+
+def _predict(model, images, device, batch_size=1, max_side=None, tile_size=None, tile_overlap=0.2):
     """
-    对上传图像进行推理并绘图标注检测框（仅显示编号，字号更大）。
-    
-    Returns:
-        result_img: PIL.Image with red/orange boxes and large number labels
-        total_count: int, all predicted boxes
-        kept_count: int, boxes with score > threshold
-        kept_scores: list of float, scores > threshold (顺序与编号一致)
+    按输入尺寸策略对多张图像推理，返回与输入顺序一致的 [Detection, ...]（原图坐标）。
+    相同尺寸的输入（整图或切块）被分到同一组，每组按 batch_size 拼成一个批次。
     """
     transform = transforms.Compose([transforms.ToTensor()])
-    image_tensor = transform(image).unsqueeze(0)
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    # 每个推理单元：(所属图像序号, 切块左上角偏移, 图像/切块)
+    scales = []
+    items = []
+    for idx, image in enumerate(images):
+        image, scale = downscale(image, max_side)
+        scales.append(scale)
+        if tile_size:
+            for region in tile_regions(image.size, tile_size, tile_overlap):
+                items.append((idx, region[:2], image.crop(region)))
+        else:
+            items.append((idx, (0, 0), image))
 
-    model = get_faster_rcnn_model(num_classes=2)
-    model.load_state_dict(torch.load(model_path, map_location=device)['model_state_dict'])
-    model.to(device)
-    model.eval()
+    # 按尺寸分组，避免不同大小的帧在同一批次中被填充到最大尺寸
+    groups = {}
+    for item_idx, (_, _, image) in enumerate(items):
+        groups.setdefault(image.size, []).append(item_idx)
 
+    boxes = [[] for _ in images]
+    scores = [[] for _ in images]
+    labels = [[] for _ in images]
     with torch.no_grad():
-        output = model(image_tensor.to(device))[0]
+        for indices in groups.values():
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start:start + batch_size]
+                batch = [transform(items[i][2]).to(device) for i in chunk]
+                for i, output in zip(chunk, model(batch)):
+                    idx, (left, top), _ = items[i]
+                    offset = torch.tensor([left, top, left, top], dtype=output["boxes"].dtype)
+                    boxes[idx].append((output["boxes"].cpu() + offset) / scales[idx])
+                    scores[idx].append(output["scores"].cpu())
+                    labels[idx].append(output["labels"].cpu())
+
+    outputs = []
+    for image_boxes, image_scores, image_labels in zip(boxes, scores, labels):
+        if tile_size:
+            image_boxes, image_scores, image_labels = merge_tile_detections(image_boxes, image_scores, image_labels)
+        else:
+            image_boxes, image_scores, image_labels = image_boxes[0], image_scores[0], image_labels[0]
+        outputs.append(Detection(
+            image_boxes.numpy().astype(np.float32),
+            image_scores.numpy().astype(np.float32),
+            image_labels.numpy().astype(np.int32),
+        ))
+    return outputs
+
+
+def _predict_cached(images, model_path, device, batch_size=1, backend="eager", num_threads=None,
+                    max_side=None, tile_size=None, tile_overlap=0.2, use_cache=True):
+    """
+    带结果缓存的 _predict。缓存键 = 图像内容哈希 + checkpoint 标识（路径、mtime、设备）+ 推理参数，
+    不包含置信度阈值：阈值过滤在缓存之外进行。只有未命中的图像才会送入模型。
+    """
+    if not use_cache:
+        model = get_detector(model_path, device, backend=backend, num_threads=num_threads)
+        return _predict(model, images, device, batch_size=batch_size, max_side=max_side,
+                        tile_size=tile_size, tile_overlap=tile_overlap)
+
+    identity = checkpoint_key(model_path, device) + (backend, max_side, tile_size, tile_overlap)
+    keys = [identity + (image_digest(image),) for image in images]
+    outputs = [detection_cache.get(key) for key in keys]
+    missing = [i for i, output in enumerate(outputs) if output is None]
+
+    if missing:
+        # 从进程级缓存获取模型，避免每张图像重复构建和加载权重
+        model = get_detector(model_path, device, backend=backend, num_threads=num_threads)
+        computed = _predict(model, [images[i] for i in missing], device, batch_size=batch_size,
+                            max_side=max_side, tile_size=tile_size, tile_overlap=tile_overlap)
+        for i, output in zip(missing, computed):
+            outputs[i] = output
+            detection_cache.put(keys[i], output)
+    return outputs
+
+
+def detect(images, model_path: str = "config/faster_rcnn.pth", batch_size: int = 8,
+           backend: str = "eager", num_threads: int = None,
+           max_side: int = None, tile_size: int = None, tile_overlap: float = 0.2,
+           use_cache: bool = True):
+    """
+    只做检测、不绘图：返回原始 boxes / scores / labels（NumPy 数组），不复制图像。
+    阈值过滤用 Detection.filter，绘图用 render_detections。
+
+    Args:
+        images: PIL.Image 或 list of PIL.Image
+        其余参数含义同 run_inference_on_image / run_inference_on_images
+
+    Returns:
+        单张图像返回 Detection；列表返回 list of Detection（与输入顺序一致）
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be >= 1")
+
+    single = isinstance(images, Image.Image)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    boxes = output["boxes"].cpu().numpy()
-    scores = output["scores"].cpu().numpy()
+    outputs = _predict_cached([images] if single else list(images), model_path, device,
+                              batch_size=batch_size, backend=backend, num_threads=num_threads,
+                              max_side=max_side, tile_size=tile_size, tile_overlap=tile_overlap,
+                              use_cache=use_cache)
+    return outputs[0] if single else outputs
 
-    result_img = image.copy()
-    draw = ImageDraw.Draw(result_img)
 
-    kept_scores = []
-    kept_boxes = []
-    total_count = len(scores)
+def run_inference_on_image(image: Image.Image, model_path: str = "config/faster_rcnn.pth", score_threshold: float = 0.7,
+                           backend: str = "eager", num_threads: int = None,
+                           max_side: int = None, tile_size: int = None, tile_overlap: float = 0.2,
+                           use_cache: bool = True):
+    """
+    对上传图像进行推理并绘图标注检测框（仅显示编号，字号更大）。
 
-    for i, score in enumerate(scores):
-        if score >= score_threshold:
-            kept_scores.append(float(score))
-            kept_boxes.append(boxes[i])
+    backend 可选 eager / quantized / script / compile（见 cpu_backend.BACKENDS），
+    num_threads 用于设置 CPU 推理线程数。
 
+    输入尺寸策略（控制大尺寸 BMP 的内存峰值和耗时）：
+        max_side: 最长边超过该值时先等比缩小再推理，检测框还原回原图坐标
+        tile_size / tile_overlap: 按重叠切块推理，跨切块 NMS 合并结果
 
-    for idx, (box, score) in enumerate(zip(kept_boxes, kept_scores)):
-        x1, y1, x2, y2 = box
-        color = "red" if score > 0.9 else "orange"
-        draw.rectangle([x1, y1, x2, y2], outline=color, width=3)
-        draw.text((x1, y1 - 50), f"{idx + 1}", fill=color, font_size=40)
+    use_cache=True 时原始检测结果按图像内容缓存（见 result_cache），
+    同一图像仅调整 score_threshold 不会重新推理。
+
+    Returns:
+        result_img: PIL.Image with red/orange boxes and large number labels
+        total_count: int, all predicted boxes
+        kept_count: int, boxes with score > threshold
+        kept_scores: list of float, scores > threshold (顺序与编号一致)
+    """
+    detection = detect(image, model_path=model_path, batch_size=1, backend=backend,
+                       num_threads=num_threads, max_side=max_side, tile_size=tile_size,
+                       tile_overlap=tile_overlap, use_cache=use_cache)
+
+    total_count = len(detection.scores)
+    kept_scores = detection.filter(score_threshold).scores.tolist()
+    result_img = render_detections(image, detection, score_threshold)
 
     kept_count = len(kept_scores)
     return result_img, total_count, kept_count, kept_scores
+
+
+def run_inference_on_images(images, model_path: str = "config/faster_rcnn.pth", score_threshold: float = 0.7, batch_size: int = 8,
+                            backend: str = "eager", num_threads: int = None,
+                            max_side: int = None, tile_size: int = None, tile_overlap: float = 0.2,
+                            use_cache: bool = True, render: bool = True):
+    """
+    批量推理多张造影帧。相同尺寸的图像被分到同一组，每组按 batch_size
+    拼成一个批次送入检测器，一次前向传播处理多帧。
+
+    Args:
+        images: list of PIL.Image
+        batch_size: 每次前向传播的最大帧数
+        backend / num_threads / max_side / tile_size / tile_overlap / use_cache: 同 run_inference_on_image
+        render: 为 False 时不生成标注图像（result_img 为 None）
+
+    Returns:
+        list of dict（与输入顺序一致），每个 dict 包含:
+            boxes: np.ndarray (N, 4)，全部预测框
+            scores: np.ndarray (N,)，全部预测得分
+            labels: np.ndarray (N,)，全部预测类别
+            result_img: 标注后的 PIL.Image
+            total_count / kept_count / kept_scores: 含义同 run_inference_on_image
+    """
+    images = list(images)  # 只遍历一次输入：生成器在 detect 中被消费后无法再与结果配对
+    detections = detect(images, model_path=model_path, batch_size=batch_size, backend=backend,
+                        num_threads=num_threads, max_side=max_side, tile_size=tile_size,
+                        tile_overlap=tile_overlap, use_cache=use_cache)
+
+    results = []
+    for image, detection in zip(images, detections):
+        kept_scores = detection.filter(score_threshold).scores.tolist()
+        results.append({
+            "boxes": detection.boxes,
+            "scores": detection.scores,
+            "labels": detection.labels,
+            "result_img": render_detections(image, detection, score_threshold) if render else None,
+            "total_count": len(detection.scores),
+            "kept_count": len(kept_scores),
+            "kept_scores": kept_scores,
+        })
+    return results
@@ -0,0 +1,69 @@
+# input_policy.py
+import torch
+from torchvision.ops import batched_nms
+from PIL import Image
+
+
+def downscale(image: Image.Image, max_side=None):
+    """
+    若图像最长边超过 max_side，则等比缩小。
+
+    Returns:
+        (缩放后的图像, 缩放比例 scale)；检测框坐标除以 scale 即还原到原图坐标。
+    """
+    width, height = image.size
+    if not max_side or max(width, height) <= max_side:
+        return image, 1.0
+    scale = max_side / max(width, height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return image.resize(size, Image.BILINEAR), scale
+
+
+def _tile_starts(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)  # 最后一块贴齐图像边缘
+    return starts
+
+
+def tile_regions(size, tile_size, overlap=0.2):
+    """
+    计算重叠切块区域。所有切块尺寸相同（图像小于切块时为整图），便于批量推理。
+
+    Args:
+        size: (width, height)
+        tile_size: 切块边长（像素）
+        overlap: 相邻切块重叠比例，[0, 1)
+
+    Returns:
+        list of (left, top, right, bottom)
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError("overlap must be in [0, 1)")
+    width, height = size
+    stride = max(1, int(tile_size * (1 - overlap)))
+    return [
+        (left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in _tile_starts(height, tile_size, stride)
+        for left in _tile_starts(width, tile_size, stride)
+    ]
+
+
+def merge_tile_detections(boxes, scores, labels, iou_threshold=0.5):
+    """
+    合并各切块（已平移到整图坐标）的检测结果，跨切块按类别做 NMS 去除重叠区域的重复框。
+
+    Args:
+        boxes: list of Tensor (Ni, 4)
+        scores: list of Tensor (Ni,)
+        labels: list of Tensor (Ni,)
+
+    Returns:
+        (boxes Tensor (K, 4), scores Tensor (K,), labels Tensor (K,))，按得分降序
+    """
+    boxes = torch.cat(boxes) if boxes else torch.zeros((0, 4))
+    scores = torch.cat(scores) if scores else torch.zeros((0,))
+    labels = torch.cat(labels) if labels else torch.zeros((0,), dtype=torch.int64)
+    keep = batched_nms(boxes, scores, labels, iou_threshold)
+    return boxes[keep], scores[keep], labels[keep]
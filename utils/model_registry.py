@@ -0,0 +1,82 @@
+# model_registry.py
+import os
+import threading
+
+import torch
+
+from .cpu_backend import optimize_detector, set_num_threads
+from .faster_rcnn import get_faster_rcnn_model
+
+# 进程级模型缓存：(checkpoint 绝对路径, 文件 mtime, device, backend) -> 已加载的 eval 模型
+_MODELS = {}
+_LOCK = threading.RLock()
+
+
+def default_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def checkpoint_key(model_path, device=None):
+    """
+    生成模型缓存键：路径 + 文件修改时间 + 设备。
+    checkpoint 被替换后 mtime 改变，下次请求会自动重新加载。
+    """
+    device = torch.device(device) if device is not None else default_device()
+    path = os.path.abspath(model_path)
+    return path, os.path.getmtime(path), str(device)
+
+
+def _warm_up(model, device):
+    # 预热：跑一次空白图像，避免首个真实请求承担初始化开销
+    with torch.no_grad():
+        model([torch.zeros(3, 256, 256, device=device)])
+    return model
+
+
+def _build_detector(model_path, device):
+    # checkpoint 会覆盖全部参数，因此只构建结构，不加载/下载 COCO 预训练权重
+    model = get_faster_rcnn_model(num_classes=2, pretrained=False)
+    state = torch.load(model_path, map_location=device)
+    model.load_state_dict(state['model_state_dict'])
+    del state
+    model.to(device)
+    model.eval()
+    return _warm_up(model, device)
+
+
+def get_detector(model_path="config/faster_rcnn.pth", device=None, backend="eager", num_threads=None):
+    """
+    获取已加载、已预热、处于 eval 模式的 Faster R-CNN 检测模型。
+
+    同一进程内（包括多个 Streamlit 会话）共享同一份模型；
+    同一 checkpoint 路径、设备和后端下的旧版本会在新版本加载后被释放。
+
+    Args:
+        backend: 推理后端，见 cpu_backend.BACKENDS（eager / quantized / script / compile）
+        num_threads: 若指定，设置 PyTorch CPU 线程数（进程级生效）
+    """
+    set_num_threads(num_threads)
+    key = checkpoint_key(model_path, device) + (backend,)
+    model = _MODELS.get(key)
+    if model is not None:
+        return model
+
+    with _LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            path, _, device_name, _ = key
+            device = torch.device(device_name)
+            if backend == "eager":
+                model = _build_detector(path, device)
+            else:
+                # 优化后端基于共享的 fp32 模型转换
+                model = _warm_up(optimize_detector(get_detector(path, device), backend), device)
+            for old_key in [k for k in _MODELS if k[0] == path and k[2:] == key[2:]]:
+                del _MODELS[old_key]
+            _MODELS[key] = model
+    return model
+
+
+def clear_registry():
+    with _LOCK:
+        _MODELS.clear()
@@ -0,0 +1,67 @@
+# result_cache.py
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+def image_digest(image: Image.Image):
+    """图像内容哈希（模式 + 尺寸 + 像素字节），与文件名、上传对象无关。"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}:{image.size}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def array_digest(*arrays):
+    """NumPy 数组内容哈希（形状 + dtype + 数据字节）。"""
+    h = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        h.update(f"{array.shape}:{array.dtype}".encode())
+        h.update(array.data)
+    return h.hexdigest()
+
+
+class LRUCache:
+    """有界 LRU 缓存（线程安全，进程内共享）。"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DetectionCache(LRUCache):
+    """
+    检测结果 LRU 缓存。
+
+    只缓存原始 boxes / scores；阈值过滤和绘图在缓存之外进行，
+    因此调整置信度阈值不需要重新前向传播。
+    """
+
+
+detection_cache = DetectionCache()